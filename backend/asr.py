@@ -1,16 +1,78 @@
-from scipy.signal import resample
 from funasr_onnx.utils.postprocess_utils import rich_transcription_postprocess
 import numpy as np
 from funasr_onnx import SenseVoiceSmall
+from backend.audio import decode_audio, resample_audio
+from backend.vad import split_at_silences
+from backend.metrics import stage_timer, observe_stage, add_audio_seconds
+from backend.transcription import StreamingSession, stitch_transcripts
+from timeit import default_timer as timer
 
-def get_asr_model():
-    return SenseVoiceSmall("iic/SenseVoiceSmall", batch_size=10, quantize=True)
+class BatchedSenseVoiceSmall(SenseVoiceSmall):
+    """
+    SenseVoiceSmall whose load_data also accepts a list of waveforms (it takes lists for file paths),
+    so that one call decodes a whole batch
+    """
+    def load_data(self, wav_content, fs=None):
+        if isinstance(wav_content, list) and all(isinstance(wav, np.ndarray) for wav in wav_content):
+            return wav_content
+        return super().load_data(wav_content, fs)
 
-def inference(audio_data: list[float], sample_rate: float, model: SenseVoiceSmall) -> str:
-    audio = np.array(audio_data, dtype=np.float64)
-    model_sr = model.frontend.opts.frame_opts.samp_freq
+def get_asr_model(batch_size: int = 10):
+    return BatchedSenseVoiceSmall("iic/SenseVoiceSmall", batch_size=batch_size, quantize=True)
+
+def transcribe_batch(audios: list[list[float] | np.ndarray], sample_rates: list[float], model: SenseVoiceSmall) -> list[str]:
+    """
+    Resamples the clips to the model's rate and decodes them in one model call; returns one transcript per clip
+    """
+    model_sr = model_sample_rate(model)
+    waveforms = []
+    for audio_data, sample_rate in zip(audios, sample_rates):
+        audio = np.asarray(audio_data, dtype=np.float32)
+        add_audio_seconds("asr", len(audio) / sample_rate)
+        if sample_rate != model_sr:
+            with stage_timer("asr_resample"):
+                audio = resample_audio(audio, sample_rate, model_sr)
+        waveforms.append(audio)
+    start = timer()
+    results = model(waveforms, language="auto", use_itn=True)
+    # clips of a batch are decoded together, so each one is accounted an equal share
+    for _ in waveforms:
+        observe_stage("asr_decode", (timer() - start) / len(waveforms))
+    return [rich_transcription_postprocess(result) for result in results]
+
+def model_sample_rate(model: SenseVoiceSmall) -> float:
+    return model.frontend.opts.frame_opts.samp_freq
+
+def inference(audio_data: list[float] | np.ndarray, sample_rate: float, model: SenseVoiceSmall) -> str:
+    return transcribe_batch([audio_data], [sample_rate], model)[0]
+
+def decode_input(body: bytes, content_type: str, sample_rate: float | None, pcm_format: str) -> tuple[np.ndarray, float]:
+    """
+    backend.audio.decode_audio, timed as the asr_input_decode stage
+    """
+    with stage_timer("asr_input_decode"):
+        return decode_audio(body, content_type, sample_rate, pcm_format)
+
+def split_long_audio(audio_data: list[float] | np.ndarray, sample_rate: float, max_chunk_s: float,
+                     model: SenseVoiceSmall) -> tuple[list[np.ndarray], float]:
+    """
+    Resamples a long recording to the model's rate once, then cuts it at pauses into chunks of at most max_chunk_s
+    (see backend.vad.split_at_silences), which can be decoded as a batch
+    returns (consecutive chunks, model sample rate)
+    """
+    model_sr = model_sample_rate(model)
+    audio = np.asarray(audio_data, dtype=np.float32)
     if sample_rate != model_sr:
-        audio = resample(audio, int(len(audio) * model_sr / sample_rate))
-    result = model(audio, language="auto", use_itn=True)[0]
-    result = rich_transcription_postprocess(result)
-    return result
\ No newline at end of file
+        with stage_timer("asr_resample"):
+            audio = resample_audio(audio, sample_rate, model_sr)
+    return [audio[start:end] for start, end in split_at_silences(audio, model_sr, max_chunk_s)], model_sr
+
+def warmup(model: SenseVoiceSmall):
+    """
+    Transcribes a second of low noise, alone and in a batch, so that the ONNX sessions have allocated their buffers
+    before the first request
+    """
+    model_sr = model_sample_rate(model)
+    noise = np.random.default_rng(0).normal(0, 0.01, int(model_sr)).astype(np.float32)
+    inference(noise, model_sr, model)
+    transcribe_batch([noise, noise[:len(noise) // 2]], [model_sr, model_sr], model)
@@ -0,0 +1,318 @@
+import io
+import struct
+from functools import lru_cache
+from math import gcd
+from typing import Literal
+import numpy as np
+import soundfile as sf
+from scipy.signal import firwin, upfirdn
+
+_pcm_dtypes = {
+    "int16": np.dtype("<i2"),
+    "float32": np.dtype("<f4"),
+}
+# containers libsndfile can read directly; everything else goes through ffmpeg (pydub)
+_soundfile_content_types = {"audio/wav", "audio/x-wav", "audio/wave", "audio/flac", "audio/ogg", "audio/opus"}
+_ffmpeg_content_types = {
+    "audio/webm": "webm",
+    "video/webm": "webm",
+    "audio/mp4": "mp4",
+    "audio/mpeg": "mp3",
+}
+_pcm_content_types = {"audio/pcm", "application/octet-stream"}
+
+def _to_mono(audio: np.ndarray) -> np.ndarray:
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1, dtype=np.float32)
+    return audio
+
+def decode_pcm(body: bytes, pcm_format: str = "int16") -> np.ndarray:
+    """
+    Raw little-endian mono PCM; float32 is decoded without copying (the result is read-only)
+    """
+    if pcm_format not in _pcm_dtypes:
+        raise ValueError(f"Unknown PCM format: {pcm_format}, expected one of {list(_pcm_dtypes)}")
+    dtype = _pcm_dtypes[pcm_format]
+    if len(body) % dtype.itemsize:
+        raise ValueError(f"PCM body length {len(body)} is not a multiple of {dtype.itemsize} bytes")
+    audio = np.frombuffer(body, dtype=dtype)
+    if pcm_format == "int16":
+        audio = audio.astype(np.float32) / 32768.0
+    return audio
+
+def _decode_with_ffmpeg(body: bytes, container_format: str) -> tuple[np.ndarray, float]:
+    from pydub import AudioSegment
+    from pydub.exceptions import CouldntDecodeError
+    try:
+        segment = AudioSegment.from_file(io.BytesIO(body), format=container_format).set_channels(1)
+    except CouldntDecodeError as e:
+        raise ValueError(f"Could not decode {container_format} audio: {e}") from e
+    audio = np.array(segment.get_array_of_samples(), dtype=np.float32) / float(1 << (8 * segment.sample_width - 1))
+    return audio, segment.frame_rate
+
+def decode_audio(body: bytes, content_type: str, sample_rate: float | None = None, pcm_format: str = "int16") -> tuple[np.ndarray, float]:
+    """
+    Decodes an audio request body to mono float32 samples
+    sample_rate is required for raw PCM and ignored for containers, which carry their own
+    returns (audio, sample_rate)
+    """
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type in _pcm_content_types:
+        if not sample_rate:
+            raise ValueError("sample_rate is required for raw PCM audio")
+        return decode_pcm(body, pcm_format), sample_rate
+    if content_type in _soundfile_content_types:
+        try:
+            audio, sample_rate = sf.read(io.BytesIO(body), dtype="float32")
+        except sf.LibsndfileError as e:
+            raise ValueError(f"Could not decode {content_type} audio: {e}") from e
+        return _to_mono(audio), sample_rate
+    if content_type in _ffmpeg_content_types:
+        return _decode_with_ffmpeg(body, _ffmpeg_content_types[content_type])
+    raise ValueError(f"Unsupported audio content type: {content_type}")
+
+def wav_stream_header(sample_rate: int, num_channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """
+    WAV header for int PCM of unknown length (RIFF and data sizes set to 0xFFFFFFFF), so PCM frames can follow as they are produced
+    """
+    byte_rate = sample_rate * num_channels * bits_per_sample // 8
+    block_align = num_channels * bits_per_sample // 8
+    return (
+        b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, num_channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b"data" + struct.pack("<I", 0xFFFFFFFF)
+    )
+
+def to_pcm16(audio: np.ndarray) -> bytes:
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+def _resampling_ratio(src_rate: float, dst_rate: float) -> tuple[int, int]:
+    src_rate, dst_rate = int(round(src_rate)), int(round(dst_rate))
+    divisor = gcd(src_rate, dst_rate)
+    return dst_rate // divisor, src_rate // divisor
+
+@lru_cache(maxsize=32)
+def _polyphase_filter(up: int, down: int) -> tuple[np.ndarray, int]:
+    """
+    The anti-aliasing filter scipy's resample_poly designs for up/down (Kaiser window, beta 5), scaled by up and
+    zero-padded in front so that the output samples are centered
+    returns (filter, number of leading upfirdn outputs to drop)
+    """
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    pre_pad = down - half_len % down
+    taps = firwin(2 * half_len + 1, 1.0 / max_rate, window=("kaiser", 5.0)) * up
+    return np.concatenate([np.zeros(pre_pad), taps]).astype(np.float32), (half_len + pre_pad) // down
+
+def _fit_length(audio: np.ndarray, length: int) -> np.ndarray:
+    return audio[:length] if len(audio) >= length else np.pad(audio, (0, length - len(audio)))
+
+def resample_audio(audio: np.ndarray, src_rate: float, dst_rate: float) -> np.ndarray:
+    """
+    Rational polyphase resampling in float32, equal to scipy's resample_poly, with the filter cached per rate pair
+    """
+    if src_rate == dst_rate:
+        return audio
+    up, down = _resampling_ratio(src_rate, dst_rate)
+    audio = np.asarray(audio, dtype=np.float32)
+    if up == down:
+        return audio
+    taps, skip = _polyphase_filter(up, down)
+    num_output = -(-len(audio) * up // down)
+    return _fit_length(upfirdn(taps, audio, up, down)[skip:], num_output)
+
+class StreamingResampler:
+    """
+    resample_audio for audio arriving chunk by chunk: the outputs of process() and flush() put together equal
+    resample_audio of the whole input. Outputs that depend on samples not received yet (about half the filter,
+    under a millisecond) are held back until the next chunk or flush().
+    """
+    def __init__(self, src_rate: float, dst_rate: float):
+        self.up, self.down = _resampling_ratio(src_rate, dst_rate)
+        self._taps, self._skip = _polyphase_filter(self.up, self.down) if self.up != self.down else (None, 0)
+        self._buffer = np.zeros(0, dtype=np.float32)
+        # the buffer always starts at a multiple of down, where input and output samples line up
+        self._buffer_start = 0
+        self._received = 0
+        self._emitted = 0
+
+    def process(self, audio: np.ndarray) -> np.ndarray:
+        audio = np.asarray(audio, dtype=np.float32)
+        if self._taps is None:
+            return audio
+        self._buffer = np.concatenate([self._buffer, audio])
+        self._received += len(audio)
+        # output n needs the inputs up to (n + skip) * down / up
+        return self._take(-(-self._received * self.up // self.down) - self._skip)
+
+    def flush(self) -> np.ndarray:
+        if self._taps is None:
+            return np.zeros(0, dtype=np.float32)
+        return self._take(-(-self._received * self.up // self.down))
+
+    def _take(self, end: int) -> np.ndarray:
+        if end <= self._emitted:
+            return np.zeros(0, dtype=np.float32)
+        first = self._emitted + self._skip - self._buffer_start * self.up // self.down
+        output = _fit_length(upfirdn(self._taps, self._buffer, self.up, self.down)[first:], end - self._emitted)
+        self._emitted = end
+        # inputs before the window of the next output are not needed anymore
+        needed = max(0, -(-((end + self._skip) * self.down - len(self._taps) + 1) // self.up))
+        start = needed // self.down * self.down
+        if start > self._buffer_start:
+            self._buffer = self._buffer[start - self._buffer_start:]
+            self._buffer_start = start
+        return output
+
+OutputFormat = Literal["wav", "wav-int16", "pcm", "mp3", "ogg"]
+output_media_types = {
+    "wav": "audio/wav",
+    "wav-int16": "audio/wav",
+    "pcm": "audio/pcm",
+    "mp3": "audio/mpeg",
+    "ogg": "audio/ogg",
+}
+# (format, subtype) for soundfile
+_soundfile_output_formats = {
+    "wav": ("WAV", "FLOAT"),
+    "mp3": ("MP3", "MPEG_LAYER_III"),
+    "ogg": ("OGG", "OPUS"),
+}
+_opus_sample_rates = {8000, 12000, 16000, 24000, 48000}
+
+def check_output_format(output_format: str, sample_rate: int):
+    if output_format not in output_media_types:
+        raise ValueError(f"Unknown output format: {output_format}, expected one of {list(output_media_types)}")
+    if output_format == "ogg" and sample_rate not in _opus_sample_rates:
+        raise ValueError(f"Opus only supports sample rates {sorted(_opus_sample_rates)}")
+    if not 8000 <= sample_rate <= 48000:
+        raise ValueError("sample_rate must be between 8000 and 48000")
+
+def _encode_with_soundfile(audio: np.ndarray, sample_rate: int, output_format: str) -> bytes:
+    container, subtype = _soundfile_output_formats[output_format]
+    result = io.BytesIO()
+    sf.write(result, audio, sample_rate, format=container, subtype=subtype)
+    return result.getvalue()
+
+def encode_audio(audio: np.ndarray, sample_rate: int, output_format: OutputFormat = "wav") -> bytes:
+    """
+    Encodes a whole mono float clip; "wav" is 32-bit float, "wav-int16"/"pcm" are 16-bit (pcm without header),
+    "mp3" and "ogg" (Opus) are compressed
+    """
+    if output_format == "wav-int16":
+        pcm = to_pcm16(audio)
+        header = bytearray(wav_stream_header(sample_rate))
+        struct.pack_into("<I", header, 4, 36 + len(pcm))
+        struct.pack_into("<I", header, 40, len(pcm))
+        return bytes(header) + pcm
+    if output_format == "pcm":
+        return to_pcm16(audio)
+    return _encode_with_soundfile(audio, sample_rate, output_format)
+
+class _AppendOnlySink:
+    """
+    File-like target for soundfile that hands out the bytes written so far; rewrites of already emitted bytes
+    (e.g. the MP3 Xing header patched at close) are dropped, which players tolerate for streams
+    """
+    def __init__(self):
+        self._pending = bytearray()
+        self._emitted = 0
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        end = self._emitted + len(self._pending)
+        if self._position >= end:
+            self._pending += data
+        elif self._position >= self._emitted:
+            offset = self._position - self._emitted
+            self._pending[offset:offset + len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = self._emitted + len(self._pending) + offset
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        return b""
+
+    def take(self) -> bytes:
+        data = bytes(self._pending)
+        self._emitted += len(data)
+        self._pending.clear()
+        return data
+
+_mp3_bitrates_kbps = {
+    "mpeg1": [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    "mpeg2": [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_mp3_sample_rates = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+def _mp3_frame_length(header: bytes) -> int:
+    """
+    Byte length of the Layer III frame starting with header
+    """
+    value = int.from_bytes(header[:4], "big")
+    version = (value >> 19) & 3
+    bitrate = _mp3_bitrates_kbps["mpeg1" if version == 3 else "mpeg2"][(value >> 12) & 15] * 1000
+    sample_rate = _mp3_sample_rates[version][(value >> 10) & 3]
+    padding = (value >> 9) & 1
+    return (144 if version == 3 else 72) * bitrate // sample_rate + padding
+
+class StreamEncoder:
+    """
+    Encodes audio that arrives chunk by chunk (e.g. one TTS segment at a time) into one playable stream:
+    wav-int16 gets a header of unknown length followed by PCM, pcm is headerless, and mp3/ogg are encoded
+    by one continuous encoder whose output is handed out as it is produced. "wav" streams as wav-int16.
+    Chunks are resampled from src_rate to sample_rate as one continuous signal, so segment boundaries do not click.
+    Call close() to get the encoder's trailing bytes.
+    """
+    def __init__(self, src_rate: int, sample_rate: int, output_format: OutputFormat = "wav-int16"):
+        self.src_rate = src_rate
+        self.sample_rate = sample_rate
+        self.output_format = "wav-int16" if output_format == "wav" else output_format
+        self.media_type = output_media_types[self.output_format]
+        self._sink = None
+        self._file = None
+        self._skipped_vbr_frame = False
+        self._resampler = StreamingResampler(src_rate, sample_rate)
+        if self.output_format in _soundfile_output_formats:
+            container, subtype = _soundfile_output_formats[self.output_format]
+            self._sink = _AppendOnlySink()
+            self._file = sf.SoundFile(self._sink, "w", sample_rate, 1, format=container, subtype=subtype)
+
+    def header(self) -> bytes:
+        if self.output_format == "wav-int16":
+            return wav_stream_header(self.sample_rate)
+        return b""
+
+    def encode(self, audio: np.ndarray) -> bytes:
+        return self._encode_resampled(self._resampler.process(audio))
+
+    def _encode_resampled(self, audio: np.ndarray) -> bytes:
+        if self._file is None:
+            return to_pcm16(audio)
+        self._file.write(audio)
+        data = self._sink.take()
+        if self.output_format == "mp3" and not self._skipped_vbr_frame and len(data) >= 4:
+            # the first frame is a placeholder for the VBR (Xing) header, which is only filled in at close;
+            # left empty it makes decoders misjudge the stream length, so it is dropped
+            data = data[_mp3_frame_length(data):]
+            self._skipped_vbr_frame = True
+        return data
+
+    def close(self) -> bytes:
+        data = self._encode_resampled(self._resampler.flush())
+        if self._file is None:
+            return data
+        self._file.close()
+        return data + self._sink.take()
@@ -0,0 +1,69 @@
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable
+from backend.tracing import annotate
+
+class MicroBatcher:
+    """
+    Groups concurrent submit() calls into batches: a batch is dispatched once it holds max_batch_size items,
+    or max_wait_s after its first item arrived. run_batch(items) is an async callable returning one result per item;
+    its exception fails every item of the batch. Batches run in a context of their own, not in one of the requests';
+    each request's trace gets a {name}_batch_size attribute.
+    """
+    def __init__(self, name: str, run_batch: Callable[[list], Awaitable[list]], max_batch_size: int = 8, max_wait_s: float = 0.005):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_s
+        self._items = []
+        self._timer = None
+        self._batches = 0
+        self._batched_items = 0
+        self._full_batches = 0
+
+    async def submit(self, item: Any):
+        future = asyncio.get_running_loop().create_future()
+        self._items.append((item, future))
+        if len(self._items) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait_s, self._dispatch)
+        result, batch_size = await future
+        annotate(**{f"{self.name}_batch_size": batch_size})
+        return result
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # requests cancelled while waiting (e.g. the client left) are dropped from the batch
+        items = [(item, future) for item, future in self._items if not future.done()]
+        self._items = []
+        if not items:
+            return
+        self._batches += 1
+        self._batched_items += len(items)
+        self._full_batches += len(items) >= self.max_batch_size
+        contextvars.Context().run(asyncio.create_task, self._run(items))
+
+    async def _run(self, items: list):
+        try:
+            results = await self.run_batch([item for item, _ in items])
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(items, results):
+            if not future.done():
+                future.set_result((result, len(items)))
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_s * 1000,
+            "batches": self._batches,
+            "items": self._batched_items,
+            "mean_batch_size": self._batched_items / self._batches if self._batches else 0.0,
+            "full_batches": self._full_batches,
+        }
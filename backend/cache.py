@@ -0,0 +1,216 @@
+import hashlib
+import os
+import pickle
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable
+import numpy as np
+
+def _default_size_of(value: Any) -> int:
+    return getattr(value, "nbytes", None) or len(pickle.dumps(value))
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by total value size (max_bytes), with an optional on-disk tier.
+    With disk_dir set, every put is also written there (bounded by max_disk_bytes, oldest files removed first),
+    so entries evicted from memory, or from a previous run, are loaded back on a hit.
+    """
+    def __init__(self, max_bytes: int, size_of: Callable[[Any], int] = _default_size_of,
+                 disk_dir: str | None = None, max_disk_bytes: int | None = None):
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._disk_files = OrderedDict()
+        self._disk_bytes = 0
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+            paths = [os.path.join(disk_dir, name) for name in os.listdir(disk_dir) if name.endswith(".pkl")]
+            for path in sorted(paths, key=os.path.getmtime):
+                self._disk_files[path] = os.path.getsize(path)
+                self._disk_bytes += self._disk_files[path]
+
+    def _disk_path(self, key: Hashable) -> str:
+        return os.path.join(self.disk_dir, hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".pkl")
+
+    def _put_memory(self, key: Hashable, value: Any):
+        size = self.size_of(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._evictions += 1
+
+    def _get_disk(self, key: Hashable):
+        path = self._disk_path(key)
+        if path not in self._disk_files:
+            return None
+        try:
+            with open(path, "rb") as f:
+                stored_key, value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if stored_key != key:
+            return None
+        self._disk_files.move_to_end(path)
+        os.utime(path)
+        return value
+
+    def _put_disk(self, key: Hashable, value: Any):
+        path = self._disk_path(key)
+        with open(path, "wb") as f:
+            pickle.dump((key, value), f)
+        if path in self._disk_files:
+            self._disk_bytes -= self._disk_files.pop(path)
+        self._disk_files[path] = os.path.getsize(path)
+        self._disk_bytes += self._disk_files[path]
+        while self.max_disk_bytes is not None and self._disk_bytes > self.max_disk_bytes and len(self._disk_files) > 1:
+            evicted_path, evicted_size = self._disk_files.popitem(last=False)
+            self._disk_bytes -= evicted_size
+            if os.path.exists(evicted_path):
+                os.remove(evicted_path)
+
+    def get(self, key: Hashable):
+        """
+        returns the cached value or None
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key][0]
+            if self.disk_dir is not None:
+                value = self._get_disk(key)
+                if value is not None:
+                    self._disk_hits += 1
+                    self._put_memory(key, value)
+                    return value
+            self._misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._put_memory(key, value)
+            if self.disk_dir is not None:
+                self._put_disk(key, value)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries or (self.disk_dir is not None and self._disk_path(key) in self._disk_files)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._disk_hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": (self._hits + self._disk_hits) / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "disk_entries": len(self._disk_files),
+                "disk_bytes": self._disk_bytes,
+            }
+
+class SemanticCache:
+    """
+    Cache keyed by meaning: lookup() embeds the text and returns the value of the most similar cached text
+    if its cosine similarity is at least threshold.
+    Entries are tagged with version and only match while it is current (e.g. the vectorstore they were answered from),
+    expire after ttl_s seconds, and the least recently used entry is evicted beyond max_entries.
+    """
+    def __init__(self, embed: Callable[[str], list[float]], threshold: float = 0.95, max_entries: int = 1024,
+                 ttl_s: float | None = 24 * 3600, version: str = ""):
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.version = version
+        self._lock = Lock()
+        self._matrix = None
+        self._values = [None] * max_entries
+        self._versions = [None] * max_entries
+        self._created = np.zeros(max_entries)
+        self._last_used = np.full(max_entries, -np.inf)
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _normalized_embedding(self, text: str) -> np.ndarray:
+        embedding = np.asarray(self.embed(text), dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) + 1e-12)
+
+    def _valid_mask(self, now: float) -> np.ndarray:
+        valid = np.array([version == self.version for version in self._versions[:self._size]], dtype=bool)
+        if self.ttl_s is not None:
+            valid &= now - self._created[:self._size] <= self.ttl_s
+        return valid
+
+    def lookup(self, text: str):
+        """
+        returns (value or None, embedding); pass the embedding to put() to avoid embedding the text twice
+        """
+        embedding = self._normalized_embedding(text)
+        now = time.monotonic()
+        with self._lock:
+            if self._size:
+                similarities = self._matrix[:self._size] @ embedding
+                similarities[~self._valid_mask(now)] = -np.inf
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._last_used[best] = now
+                    self._hits += 1
+                    return self._values[best], embedding
+            self._misses += 1
+            return None, embedding
+
+    def put(self, text: str, value: Any, embedding: np.ndarray | None = None):
+        if embedding is None:
+            embedding = self._normalized_embedding(text)
+        now = time.monotonic()
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, len(embedding)), dtype=np.float32)
+            if self._size < self.max_entries:
+                slot = self._size
+                self._size += 1
+            else:
+                # reuse an invalid (expired or outdated) slot first, otherwise the least recently used one
+                invalid = np.flatnonzero(~self._valid_mask(now))
+                slot = int(invalid[0]) if len(invalid) else int(np.argmin(self._last_used))
+                self._evictions += 1
+            self._matrix[slot] = embedding
+            self._values[slot] = value
+            self._versions[slot] = self.version
+            self._created[slot] = now
+            self._last_used[slot] = now
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": int(self._valid_mask(time.monotonic()).sum()) if self._size else 0,
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "version": self.version,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+            }
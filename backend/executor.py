@@ -0,0 +1,86 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable
+
+class QueueFullError(RuntimeError):
+    pass
+
+class ModelExecutor:
+    """
+    Bounded worker pool for one model family.
+    Blocking inference runs on the pool instead of the event loop, so a slow model only delays its own queue.
+    max_queue_size=None means the queue is unbounded; otherwise run() raises QueueFullError when it is full.
+    func runs in a copy of the caller's context, so context variables (e.g. the request trace) carry over.
+    """
+    def __init__(self, name: str, max_workers: int = 1, max_queue_size: int | None = None):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+
+    def _on_start(self):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+
+    def _on_finish(self):
+        with self._lock:
+            self._running -= 1
+            self._completed += 1
+
+    def _on_cancel_before_start(self):
+        with self._lock:
+            self._queued -= 1
+
+    def _submit(self, func: Callable[..., Any], args: tuple, kwargs: dict, check_queue: bool):
+        with self._lock:
+            if check_queue and self.max_queue_size is not None and self._queued >= self.max_queue_size:
+                raise QueueFullError(f"{self.name} queue is full ({self._queued} waiting)")
+            self._queued += 1
+
+        def call():
+            self._on_start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._on_finish()
+
+        future = self._pool.submit(contextvars.copy_context().run, call)
+        future.add_done_callback(lambda f: self._on_cancel_before_start() if f.cancelled() else None)
+        return asyncio.wrap_future(future)
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs):
+        return await self._submit(func, args, kwargs, check_queue=True)
+
+    async def iterate(self, func: Callable[..., Any], *args):
+        """
+        Admits a stream like run() (raising QueueFullError if the queue is full) and returns an async iterator over
+        the blocking generator func(*args); each step runs on the pool, so concurrent streams share it step by step,
+        but skips the queue check, so an admitted stream is never cut off
+        """
+        iterator = await self.run(func, *args)
+        return self._steps(iterator)
+
+    async def _steps(self, iterator):
+        sentinel = object()
+        while (item := await self._submit(next, (iterator, sentinel), {}, check_queue=False)) is not sentinel:
+            yield item
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue_size": self.max_queue_size,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
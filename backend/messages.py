@@ -0,0 +1,34 @@
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+
+# the request and response side of RAG, without its model libraries, so that a front-end process handing RAG to a
+# worker process does not import them
+
+def get_cacheable_question(messages: list[BaseMessage]):
+    """
+    Only single-turn questions are answered from the cache, as earlier turns change the answer
+    returns the question or None
+    """
+    if len(messages) == 1 and messages[0].type == "human":
+        return messages[0].content
+    return None
+
+def messages_to_json(messages: list[BaseMessage]):
+    result_list = []
+    for message in messages:
+        result_list.append({
+            "type": message.type,
+            "content": message.content,
+            "response_metadata": message.response_metadata
+        })
+    return {"messages": result_list}
+
+def json_to_messages(json_data: dict):
+    messages = []
+    for message_data in json_data["messages"]:
+        if message_data["type"] == "human":
+            messages.append(HumanMessage(content=message_data["content"], response_metadata=message_data["response_metadata"]))
+        elif message_data["type"] == "ai":
+            messages.append(AIMessage(content=message_data["content"], response_metadata=message_data["response_metadata"]))
+        else:
+            raise ValueError(f"Unknown message type: {message_data['type']}")
+    return messages
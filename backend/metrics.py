@@ -0,0 +1,87 @@
+import contextvars
+from contextlib import contextmanager
+from timeit import default_timer as timer
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from backend.tracing import record_stage
+
+# pipeline stages: json_decode, hyde_generation, query_embedding, vector_search, prompt_build, generation,
+# tts_segment, tts_encode, asr_input_decode, asr_resample, asr_decode
+stage_duration = Histogram(
+    "echo_stage_duration_seconds", "Duration of each pipeline stage", ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+request_duration = Histogram(
+    "echo_request_duration_seconds", "Time until the response starts, by endpoint", ["endpoint"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+requests_total = Counter("echo_requests_total", "Requests by endpoint", ["endpoint"])
+errors_total = Counter("echo_request_errors_total", "Failed requests (status >= 500 or failed streams) by endpoint", ["endpoint"])
+generated_tokens_total = Counter("echo_generated_tokens_total", "Tokens generated by the chat model")
+audio_seconds_total = Counter("echo_audio_seconds_total", "Seconds of audio synthesized (tts) or transcribed (asr)", ["service"])
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    Records the duration of the block in the stage histogram and in the current request's trace
+    """
+    start = timer()
+    try:
+        yield
+    finally:
+        observe_stage(stage, timer() - start)
+
+# set in worker processes (see backend.workers): observations are collected here and replayed by the server process
+_forwarded_events = contextvars.ContextVar("forwarded_metric_events", default=None)
+
+def observe_stage(stage: str, seconds: float):
+    events = _forwarded_events.get()
+    if events is not None:
+        events.append(("stage", stage, seconds))
+        return
+    stage_duration.labels(stage).observe(seconds)
+    record_stage(stage, seconds)
+
+def record_generated_tokens(message):
+    """
+    Counts the output tokens of a chat model message (or chunk) that carries usage_metadata
+    """
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        events = _forwarded_events.get()
+        if events is not None:
+            events.append(("tokens", None, usage["output_tokens"]))
+            return
+        generated_tokens_total.inc(usage["output_tokens"])
+
+def add_audio_seconds(service: str, seconds: float):
+    events = _forwarded_events.get()
+    if events is not None:
+        events.append(("audio", service, seconds))
+        return
+    audio_seconds_total.labels(service).inc(seconds)
+
+@contextmanager
+def collect_metric_events(events: list):
+    """
+    Appends the metrics recorded in the block to events instead of recording them, for replay_metric_events
+    """
+    token = _forwarded_events.set(events)
+    try:
+        yield
+    finally:
+        _forwarded_events.reset(token)
+
+def replay_metric_events(events: list):
+    for kind, label, value in events:
+        if kind == "stage":
+            observe_stage(label, value)
+        elif kind == "tokens":
+            generated_tokens_total.inc(value)
+        elif kind == "audio":
+            audio_seconds_total.labels(label).inc(value)
+
+def metrics_payload() -> tuple[bytes, str]:
+    """
+    returns (body, content type) in the Prometheus text format
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -4,11 +4,21 @@ from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
 from langchain_core.language_models import BaseChatModel
 from langchain_core.vectorstores import VectorStore
-from langchain import hub
-from typing import Literal
+from typing import Callable, Literal
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.documents import Document
+from backend.cache import LRUCache, SemanticCache
+from backend.messages import messages_to_json, json_to_messages, get_cacheable_question
+from utils.prompts import load_prompt
+from backend.metrics import stage_timer, record_generated_tokens
+from backend.tracing import annotate
+import contextvars
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import numpy as np
+import hashlib
+import time
+import os
 
 def get_hf_vectorstore(source_dir: str):
     with open(f"{source_dir}/embedding_metadata.json", "r") as f:
@@ -17,12 +27,34 @@ def get_hf_vectorstore(source_dir: str):
     vectorstore = Chroma(embedding_function=embeddings_model, persist_directory=source_dir)
     return vectorstore
 
-_rag_prompt = hub.pull("rlm/rag-prompt")
+def get_vectorstore_version(source_dir: str):
+    """
+    Changes whenever the persisted vectorstore (or its embedding model) changes
+    """
+    digest = hashlib.sha1()
+    for name in ("embedding_metadata.json", "chroma.sqlite3"):
+        path = os.path.join(source_dir, name)
+        if os.path.exists(path):
+            digest.update(f"{name}:{os.path.getsize(path)}:{os.path.getmtime(path)}".encode())
+    return digest.hexdigest()[:12]
+
+def create_answer_cache(vectorstore: VectorStore, source_dir: str, strategy: str, threshold: float = 0.95,
+                        max_entries: int = 1024, ttl_s: float | None = 24 * 3600):
+    """
+    Semantic cache of final answers, embedding questions with the vectorstore's embedding model
+    """
+    return SemanticCache(vectorstore.embeddings.embed_query, threshold, max_entries, ttl_s,
+                         version=f"{get_vectorstore_version(source_dir)}:{strategy}")
+
+# pinned versions of the vendored prompts in utils/prompt_templates, loaded on first use
+def _get_rag_prompt():
+    return load_prompt("rag", "1")
+def _get_hypo_answer_prompt():
+    return load_prompt("hypothetical_answer", "1")
 
-_generate_hypo_answer_prompt = ChatPromptTemplate.from_template("根据以下问题生成一个简洁的假设性回答，以便用于相似性检索优化：\n\n问题：{question}\n\n假设性回答：")
 _str_output_parser = StrOutputParser()
 def _create_hypo_answer_chain(chat_model: BaseChatModel):
-    return _generate_hypo_answer_prompt | chat_model | _str_output_parser | (lambda x: x.strip())
+    return _get_hypo_answer_prompt() | chat_model | _str_output_parser | (lambda x: x.strip())
 def _retrieve_links_from_docs(docs: list[Document]):
     links = [retrieved_doc.metadata.get("url", "") for retrieved_doc in docs]
     return [link for link in links if link]
@@ -31,83 +63,303 @@ def _get_contexts_hypo_ques(docs: list[Document]):
 def _get_question(messages: list[BaseMessage]):
     return messages[-1].content
 def _enhance_latest_message(messages: list[BaseMessage], context: str):
-    new_message = _rag_prompt.invoke(
-        {
-            "context": context, 
-            "question": _get_question(messages)
-        }
-    ).to_messages()[-1]
+    with stage_timer("prompt_build"):
+        new_message = _get_rag_prompt().invoke(
+            {
+                "context": context, 
+                "question": _get_question(messages)
+            }
+        ).to_messages()[-1]
     messages[-1] = new_message
-def _rag_strategy_hypothetical_question(messages: list[BaseMessage], chat_model: BaseChatModel, vectorstore: VectorStore):
-    question = _get_question(messages)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 6})
-    chain = _create_hypo_answer_chain(chat_model) | retriever
-    retrieved_docs = chain.invoke({"question": question})
+def _search(query: str, vectorstore: VectorStore, k: int = 6):
+    with stage_timer("query_embedding"):
+        embedding = vectorstore.embeddings.embed_query(query)
+    with stage_timer("vector_search"):
+        return vectorstore.similarity_search_by_vector(embedding, k=k)
 
-    contexts = _get_contexts_hypo_ques(retrieved_docs)
-    combined_context = "\n\n".join(contexts)
-    _enhance_latest_message(messages, combined_context)
-    links = _retrieve_links_from_docs(retrieved_docs)
-    return AIMessage(content=chat_model.invoke(input=messages).content, response_metadata={"links": links}), contexts
+# question -> (hypothetical answer, its embedding), see configure_hypo_cache
+_hypo_cache = None
+_hypo_cache_version = ""
+_hypo_cache_lock = Lock()
+_hypo_cache_counts = {}
+
+def configure_hypo_cache(version: str, max_memory_mb: float = 64, disk_dir: str | None = None, max_disk_mb: float | None = None):
+    """
+    Caches the hypothetical answer of every question and its embedding, so a repeated question skips both the LLM call
+    and the embedding forward pass: an LRU bounded to max_memory_mb, plus an optional on-disk tier in disk_dir
+    bounded to max_disk_mb. version should change with the chat model and the vectorstore (see get_vectorstore_version).
+    """
+    global _hypo_cache, _hypo_cache_version
+    _hypo_cache = LRUCache(
+        int(max_memory_mb * 2**20),
+        disk_dir=disk_dir,
+        max_disk_bytes=int(max_disk_mb * 2**20) if max_disk_mb is not None else None
+    )
+    _hypo_cache_version = version
+
+def hypo_cache_stats():
+    """
+    returns the cache stats with hits and misses by strategy, or None when the cache is disabled
+    """
+    if _hypo_cache is None:
+        return None
+    with _hypo_cache_lock:
+        by_strategy = {
+            strategy: {**counts, "hit_rate": counts["hits"] / (counts["hits"] + counts["misses"])}
+            for strategy, counts in _hypo_cache_counts.items()
+        }
+    return {**_hypo_cache.stats(), "by_strategy": by_strategy}
+
+def _normalize_question(question: str):
+    return " ".join(question.split()).lower()
+
+def _hypo_cache_key(question: str):
+    return (_normalize_question(question), _hypo_cache_version)
+
+def _get_cached_hypo(question: str, strategy: str):
+    if _hypo_cache is None:
+        return None
+    cached = _hypo_cache.get(_hypo_cache_key(question))
+    with _hypo_cache_lock:
+        counts = _hypo_cache_counts.setdefault(strategy, {"hits": 0, "misses": 0})
+        counts["hits" if cached is not None else "misses"] += 1
+    return cached
+
+def _put_cached_hypo(question: str, hypo_answer: str, embedding: list[float]):
+    if _hypo_cache is not None:
+        _hypo_cache.put(_hypo_cache_key(question), (hypo_answer, np.asarray(embedding, dtype=np.float32)))
+
+def _hypo_query_embedding(question: str, chat_model: BaseChatModel, vectorstore: VectorStore, strategy: str):
+    cached = _get_cached_hypo(question, strategy)
+    annotate(hyde_cached=cached is not None)
+    if cached is not None:
+        return cached[1].tolist()
+    with stage_timer("hyde_generation"):
+        hypo_answer = _create_hypo_answer_chain(chat_model).invoke({"question": question})
+    with stage_timer("query_embedding"):
+        embedding = vectorstore.embeddings.embed_query(hypo_answer)
+    _put_cached_hypo(question, hypo_answer, embedding)
+    return embedding
+
+def _retrieve_hypothetical_question(messages: list[BaseMessage], chat_model: BaseChatModel, vectorstore: VectorStore):
+    embedding = _hypo_query_embedding(_get_question(messages), chat_model, vectorstore, "hypothetical_question")
+    with stage_timer("vector_search"):
+        retrieved_docs = vectorstore.similarity_search_by_vector(embedding, k=6)
+    return retrieved_docs, _get_contexts_hypo_ques(retrieved_docs)
 
 def _get_contexts_raw(docs: list[Document]):
     return [doc.page_content for doc in docs]
-def _rag_strategy_raw(messages: list[BaseMessage], chat_model: BaseChatModel, vectorstore: VectorStore):
-    question = _get_question(messages)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 6})
-    retrieved_docs = retriever.invoke(question)
+def _retrieve_raw(messages: list[BaseMessage], chat_model: BaseChatModel, vectorstore: VectorStore):
+    retrieved_docs = _search(_get_question(messages), vectorstore)
+    return retrieved_docs, _get_contexts_raw(retrieved_docs)
 
-    contexts = _get_contexts_raw(retrieved_docs)
-    combined_context = "\n\n".join(contexts)
-    _enhance_latest_message(messages, combined_context)
-    links = _retrieve_links_from_docs(retrieved_docs)
-    return AIMessage(content=chat_model.invoke(input=messages).content, response_metadata={"links": links}), contexts
+def _retrieve_hypothetical_question_with_raw(messages: list[BaseMessage], chat_model: BaseChatModel, vectorstore: VectorStore):
+    embedding = _hypo_query_embedding(_get_question(messages), chat_model, vectorstore, "hypothetical_question_with_raw")
+    with stage_timer("vector_search"):
+        retrieved_docs = vectorstore.similarity_search_by_vector(embedding, k=6)
+    return retrieved_docs, _get_contexts_raw(retrieved_docs)
+
+def _get_contexts_speculative(docs: list[Document]):
+    # works on any vectorstore: hypothetical question docs carry their original doc, raw docs are the context
+    return [doc.metadata.get("original_doc", doc.page_content) for doc in docs]
 
-def _rag_strategy_hypothetical_question_with_raw(messages: list[BaseMessage], chat_model: BaseChatModel, vectorstore: VectorStore):
+def _reciprocal_rank_fusion(doc_lists: list[list[Document]], k: int = 6, rrf_k: int = 60):
+    """
+    Merges ranked lists by summing 1 / (rrf_k + rank) for every list a doc appears in
+    returns the top k docs
+    """
+    scores, docs_by_key = {}, {}
+    for docs in doc_lists:
+        for rank, doc in enumerate(docs):
+            key = getattr(doc, "id", None) or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1 / (rrf_k + rank + 1)
+            docs_by_key.setdefault(key, doc)
+    return [docs_by_key[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+_speculative_budget_s = 2.0
+_speculative_counts = {"fused": 0, "fallbacks": 0, "errors": 0}
+_speculative_counts_lock = Lock()
+_speculative_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="rag-hyde")
+def configure_speculative_retrieval(budget_s: float = 2.0, max_workers: int = 16):
+    """
+    Seconds the speculative strategy waits for the hypothetical answer before answering from raw retrieval alone,
+    and max hypothetical answers generated at once
+    """
+    global _speculative_budget_s, _speculative_pool
+    _speculative_budget_s = budget_s
+    # answers already being generated in the old pool still finish and fill the cache, but its threads then exit
+    old_pool, _speculative_pool = _speculative_pool, ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rag-hyde")
+    old_pool.shutdown(wait=False)
+
+def _retrieve_speculative(messages: list[BaseMessage], chat_model: BaseChatModel, vectorstore: VectorStore):
+    # the hypothetical answer is generated while the raw question is retrieved; a late one is still finished in
+    # the background so that it lands in the hypothetical answer cache for the next time
+    deadline = time.monotonic() + _speculative_budget_s
     question = _get_question(messages)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 6})
-    chain = _create_hypo_answer_chain(chat_model) | retriever
-    retrieved_docs = chain.invoke({"question": question})
+    hypo_future = _speculative_pool.submit(contextvars.copy_context().run, _hypo_query_embedding, question, chat_model, vectorstore, "speculative")
+    raw_docs = _search(question, vectorstore)
+    try:
+        hypo_embedding = hypo_future.result(timeout=max(deadline - time.monotonic(), 0))
+    except FutureTimeoutError:
+        with _speculative_counts_lock:
+            _speculative_counts["fallbacks"] += 1
+        annotate(speculative="fallback")
+        return raw_docs, _get_contexts_speculative(raw_docs)
+    except Exception as e:
+        # a failed hypothetical answer (e.g. the chat model is unreachable) only costs the fused retrieval
+        with _speculative_counts_lock:
+            _speculative_counts["fallbacks"] += 1
+            _speculative_counts["errors"] += 1
+        annotate(speculative="fallback", speculative_error=f"{type(e).__name__}: {e}")
+        return raw_docs, _get_contexts_speculative(raw_docs)
+    with _speculative_counts_lock:
+        _speculative_counts["fused"] += 1
+    annotate(speculative="fused")
+    with stage_timer("vector_search"):
+        hypo_docs = vectorstore.similarity_search_by_vector(hypo_embedding, k=6)
+    retrieved_docs = _reciprocal_rank_fusion([hypo_docs, raw_docs])
+    return retrieved_docs, _get_contexts_speculative(retrieved_docs)
+
+def speculative_retrieval_stats():
+    with _speculative_counts_lock:
+        return {**_speculative_counts, "budget_s": _speculative_budget_s}
 
-    contexts = _get_contexts_raw(retrieved_docs)
+RAGStrategy = Literal["hypothetical_question", "raw", "hypothetical_question_with_raw", "speculative"]
+
+_strategy_to_retrieve_func = {
+    "hypothetical_question": _retrieve_hypothetical_question,
+    "raw": _retrieve_raw,
+    "hypothetical_question_with_raw": _retrieve_hypothetical_question_with_raw,
+    "speculative": _retrieve_speculative,
+}
+_strategy_to_contexts_func = {
+    "hypothetical_question": _get_contexts_hypo_ques,
+    "raw": _get_contexts_raw,
+    "hypothetical_question_with_raw": _get_contexts_raw,
+    "speculative": _get_contexts_speculative,
+}
+
+def prepare_inference(messages: list[BaseMessage], chat_model: BaseChatModel, vectorstore: VectorStore,
+                      strategy: RAGStrategy="hypothetical_question"):
+    """
+    Retrieves contexts and replaces the latest message with the context-enhanced prompt, so that messages
+    can be sent to chat_model directly (or streamed)
+    returns (links, list[context], messages); use the returned messages when this ran in a worker process,
+    where the replacement only happens on its copy
+    """
+    if strategy not in _strategy_to_retrieve_func:
+        raise ValueError(f"Unknown strategy: {strategy}")
+    retrieved_docs, contexts = _strategy_to_retrieve_func[strategy](messages, chat_model, vectorstore)
+    annotate(strategy=strategy, k=len(retrieved_docs))
     combined_context = "\n\n".join(contexts)
     _enhance_latest_message(messages, combined_context)
     links = _retrieve_links_from_docs(retrieved_docs)
-    return AIMessage(content=chat_model.invoke(input=messages).content, response_metadata={"links": links}), contexts
-
-RAGStrategy = Literal["hypothetical_question", "raw", "hypothetical_question_with_raw"]
+    return links, contexts, messages
 
 def inference(messages: list[BaseMessage], chat_model: BaseChatModel, vectorstore: VectorStore, 
               strategy: RAGStrategy="hypothetical_question"):
     """
     returns (new_message, list[context])
     """
-    if strategy == "hypothetical_question":
-        return _rag_strategy_hypothetical_question(messages, chat_model, vectorstore)
-    elif strategy == "raw":
-        return _rag_strategy_raw(messages, chat_model, vectorstore)
-    elif strategy == "hypothetical_question_with_raw":
-        return _rag_strategy_hypothetical_question_with_raw(messages, chat_model, vectorstore)
-    else:
-        raise ValueError(f"Unknown strategy: {strategy}")
+    links, contexts, messages = prepare_inference(messages, chat_model, vectorstore, strategy)
+    with stage_timer("generation"):
+        answer = chat_model.invoke(input=messages)
+    record_generated_tokens(answer)
+    if answer.usage_metadata:
+        annotate(prompt_tokens=answer.usage_metadata["input_tokens"], output_tokens=answer.usage_metadata["output_tokens"])
+    return AIMessage(content=answer.content, response_metadata={"links": links}, usage_metadata=answer.usage_metadata), contexts
     
-def messages_to_json(messages: list[BaseMessage]):
-    result_list = []
-    for message in messages:
-        result_list.append({
-            "type": message.type,
-            "content": message.content,
-            "response_metadata": message.response_metadata
-        })
-    return {"messages": result_list}
-
-def json_to_messages(json_data: dict):
-    messages = []
-    for message_data in json_data["messages"]:
-        if message_data["type"] == "human":
-            messages.append(HumanMessage(content=message_data["content"], response_metadata=message_data["response_metadata"]))
-        elif message_data["type"] == "ai":
-            messages.append(AIMessage(content=message_data["content"], response_metadata=message_data["response_metadata"]))
-        else:
-            raise ValueError(f"Unknown message type: {message_data['type']}")
-    return messages
\ No newline at end of file
+def warmup(chat_model: BaseChatModel, vectorstore: VectorStore, source_dir: str):
+    """
+    Reads the persisted vector index files into the page cache, then runs an embedding, a search (which loads
+    the Chroma HNSW index) and a short generation, without touching the answer and hypothetical answer caches
+    """
+    for root, _, files in os.walk(source_dir):
+        for name in files:
+            if name.endswith(".bin"):
+                with open(os.path.join(root, name), "rb") as f:
+                    while f.read(1 << 20):
+                        pass
+    embedding = vectorstore.embeddings.embed_query("上海交通大学")
+    vectorstore.similarity_search_by_vector(embedding, k=6)
+    chat_model.invoke([HumanMessage(content="你好")])
+
+def cached_inference(messages: list[BaseMessage], chat_model: BaseChatModel, vectorstore: VectorStore,
+                     strategy: RAGStrategy="hypothetical_question", answer_cache: SemanticCache | None = None):
+    """
+    inference, answered from answer_cache when a similar enough question was answered before
+    (the new message then has response_metadata["cached"] = True)
+    returns (new_message, list[context])
+    """
+    question = get_cacheable_question(messages) if answer_cache is not None else None
+    if question is None:
+        return inference(messages, chat_model, vectorstore, strategy)
+    cached, embedding = answer_cache.lookup(question)
+    annotate(answer_cached=cached is not None)
+    if cached is not None:
+        return AIMessage(content=cached["content"], response_metadata={"links": cached["links"], "cached": True}), cached["contexts"]
+    new_message, contexts = inference(messages, chat_model, vectorstore, strategy)
+    answer_cache.put(question, {"content": new_message.content, "links": new_message.response_metadata["links"], "contexts": contexts}, embedding)
+    return new_message, contexts
+
+def _batch_generate(chat_model: BaseChatModel, messages_list: list[list[BaseMessage]], max_batch_size: int | None = None,
+                    progress_callback: Callable[[int, int], None] | None = None) -> list[BaseMessage]:
+    if hasattr(chat_model, "batch_generate"):
+        return chat_model.batch_generate(messages_list, max_batch_size, progress_callback)
+    results = chat_model.batch(messages_list)
+    if progress_callback:
+        progress_callback(len(results), len(results))
+    return results
+
+def _embed_queries(texts: list[str], vectorstore: VectorStore) -> list[list[float]]:
+    # embed_query, not embed_documents: models with a query instruction embed both differently, and the hypothetical
+    # answer cache is shared with the online path
+    with stage_timer("query_embedding"):
+        return [vectorstore.embeddings.embed_query(text) for text in texts]
+
+def batch_inference(messages_list: list[list[BaseMessage]], chat_model: BaseChatModel, vectorstore: VectorStore,
+                    strategy: RAGStrategy="hypothetical_question", max_batch_size: int | None = None,
+                    progress_callback: Callable[[int, int], None] | None = None):
+    """
+    Batched version of inference for offline jobs: hypothetical answers (of questions missing from the hypothetical
+    answer cache), query embeddings and final answers are each computed in one batch.
+    progress_callback(num_done, num_total) reports the final generation.
+    returns list[(new_message, list[context])] in input order
+    """
+    if strategy not in _strategy_to_retrieve_func:
+        raise ValueError(f"Unknown strategy: {strategy}")
+    questions = [_get_question(messages) for messages in messages_list]
+    if strategy in ("raw", "speculative"):
+        raw_embeddings = _embed_queries(questions, vectorstore)
+    if strategy == "raw":
+        query_embeddings = raw_embeddings
+    else:
+        query_embeddings = [None] * len(questions)
+        missing = []
+        for i, question in enumerate(questions):
+            cached = _get_cached_hypo(question, strategy)
+            if cached is not None:
+                query_embeddings[i] = cached[1].tolist()
+            else:
+                missing.append(i)
+        if missing:
+            hypo_prompts = [_get_hypo_answer_prompt().invoke({"question": questions[i]}).to_messages() for i in missing]
+            hypo_answers = [message.content.strip() for message in _batch_generate(chat_model, hypo_prompts, max_batch_size)]
+            for i, hypo_answer, embedding in zip(missing, hypo_answers, _embed_queries(hypo_answers, vectorstore)):
+                _put_cached_hypo(questions[i], hypo_answer, embedding)
+                query_embeddings[i] = embedding
+    all_links, all_contexts = [], []
+    for i, (messages, query_embedding) in enumerate(zip(messages_list, query_embeddings)):
+        retrieved_docs = vectorstore.similarity_search_by_vector(query_embedding, k=6)
+        if strategy == "speculative":
+            # offline there is no latency budget, always fuse
+            retrieved_docs = _reciprocal_rank_fusion([retrieved_docs, vectorstore.similarity_search_by_vector(raw_embeddings[i], k=6)])
+        contexts = _strategy_to_contexts_func[strategy](retrieved_docs)
+        _enhance_latest_message(messages, "\n\n".join(contexts))
+        all_links.append(_retrieve_links_from_docs(retrieved_docs))
+        all_contexts.append(contexts)
+    answers = _batch_generate(chat_model, messages_list, max_batch_size, progress_callback)
+    return [
+        (AIMessage(content=answer.content, response_metadata={"links": links}), contexts)
+        for answer, links, contexts in zip(answers, all_links, all_contexts)
+    ]
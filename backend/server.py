@@ -1,17 +1,26 @@
 import setproctitle
-from utils.models import QwenModel
-from backend.rag import get_hf_vectorstore, messages_to_json, json_to_messages
-from backend.rag import inference as rag_inference, RAGStrategy
-from backend.tts import get_tts_model_and_config
-from backend.tts import inference as tts_inference
-from backend.asr import get_asr_model
-from backend.asr import inference as asr_inference
-from fastapi import FastAPI, Request
+from backend.audio import decode_pcm, check_output_format, output_media_types
+from backend.executor import ModelExecutor, QueueFullError
+from backend.batching import MicroBatcher
+from backend.workers import WorkerProcess, WorkerUnavailableError, ModelRef, call_method, call_function
+from backend.metrics import stage_timer, request_duration, requests_total, errors_total, record_generated_tokens, metrics_payload
+from backend.tracing import configure_trace_log, start_trace, current_trace, finish_trace, annotate
+from backend.traffic import TrafficSampler
+from fastapi import FastAPI, Request, HTTPException, WebSocket, WebSocketDisconnect
 from ml_web_inference import StreamingResponse, Response
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from timeit import default_timer as timer
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Iterable
+import numpy as np
+import importlib
+import json
+import asyncio
+if TYPE_CHECKING:
+    from backend.rag import RAGStrategy
 
 chat_model = None
 vectorstore = None
@@ -19,50 +28,461 @@ tts_model = None
 tts_config = None
 asr_model = None
 
-def launch_server(chat_model_name: str, hf_vectorstore_source_dir: str, port: int, rag_strategy: RAGStrategy="hypothetical_question", llm_gpu_memory_utilization: float = 0.6):
-    @contextmanager
-    def timer_context(task_name: str = ""):
-        start = timer()
-        yield
-        end = timer()
-        print(f"Elapsed time {f'for {task_name}' if task_name else ''}: {end - start:.3f}s")
-    global chat_model, vectorstore
-    setproctitle.setproctitle('SJTU-Echo-Server')
+all_services = ("rag", "tts", "asr")
 
-    if chat_model_name.startswith("Qwen/"):
-        chat_model = QwenModel(model=chat_model_name,gpu_memory_utilization=llm_gpu_memory_utilization)
-    else:
-        raise ValueError(f"Unknown chat model: {chat_model_name}")
-    vectorstore = get_hf_vectorstore(hf_vectorstore_source_dir)
+# the loaders are module-level so that worker processes can run them; each returns {name: object}
+def _load_rag(chat_model_name: str, hf_vectorstore_source_dir: str, rag_strategy: "RAGStrategy", llm_gpu_memory_utilization: float,
+              llm_max_num_seqs: int, rag_concurrency: int, rag_cache_size: int, rag_cache_threshold: float, rag_cache_ttl_s: float | None,
+              rag_hypo_cache_mb: float, rag_hypo_cache_dir: str | None, rag_hypo_cache_disk_mb: float | None, rag_speculative_budget_s: float):
+    from utils.models import QwenModel
+    from backend.rag import get_hf_vectorstore, create_answer_cache, configure_hypo_cache, get_vectorstore_version, configure_speculative_retrieval
+    # the LLM loads while the embedding model loads here
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader") as pool:
+        chat_model_future = pool.submit(QwenModel, model=chat_model_name, gpu_memory_utilization=llm_gpu_memory_utilization,
+                                        async_engine=True, max_num_seqs=llm_max_num_seqs)
+        vectorstore = get_hf_vectorstore(hf_vectorstore_source_dir)
+        chat_model = chat_model_future.result()
+    if rag_hypo_cache_mb > 0:
+        configure_hypo_cache(f"{chat_model_name}:{get_vectorstore_version(hf_vectorstore_source_dir)}",
+                             rag_hypo_cache_mb, rag_hypo_cache_dir, rag_hypo_cache_disk_mb)
+    configure_speculative_retrieval(rag_speculative_budget_s, rag_concurrency)
+    answer_cache = None
+    if rag_cache_size > 0:
+        answer_cache = create_answer_cache(vectorstore, hf_vectorstore_source_dir, rag_strategy, rag_cache_threshold, rag_cache_size, rag_cache_ttl_s)
+    return {"chat_model": chat_model, "vectorstore": vectorstore, "answer_cache": answer_cache}
 
+def _load_tts(tts_cache_mb: float, tts_cache_dir: str | None, tts_cache_disk_mb: float | None, tts_batch_size: int):
+    from backend.tts import get_tts_model_and_config, configure_segment_cache, configure_batch_synthesis
     tts_model, tts_config = get_tts_model_and_config()
+    if tts_cache_mb > 0:
+        configure_segment_cache(tts_cache_mb, tts_cache_dir, tts_cache_disk_mb)
+    configure_batch_synthesis(tts_batch_size)
+    return {"tts_model": tts_model, "tts_config": tts_config}
+
+def _load_asr(asr_batch_size: int):
+    from backend.asr import get_asr_model
+    return {"asr_model": get_asr_model(batch_size=max(asr_batch_size, 10))}
+
+def _service_functions(module_name: str, names: Iterable[str], in_worker: bool) -> list:
+    """
+    The functions a service runs through its executor: imported here for an in-process service,
+    or looked up by name in the worker process, so that the model libraries are only imported there
+    """
+    if in_worker:
+        return [partial(call_function, module_name, name) for name in names]
+    module = importlib.import_module(module_name)
+    return [getattr(module, name) for name in names]
+
+def launch_server(chat_model_name: str, hf_vectorstore_source_dir: str, port: int, rag_strategy: "RAGStrategy"="hypothetical_question", llm_gpu_memory_utilization: float = 0.6,
+                  rag_concurrency: int = 16, tts_concurrency: int = 1, asr_concurrency: int = 2, max_queue_size: int | None = None,
+                  llm_max_num_seqs: int = 256, tts_cache_mb: float = 256, tts_cache_dir: str | None = None,
+                  tts_cache_disk_mb: float | None = 2048, tts_cache_prefill_path: str | None = None,
+                  tts_batch_size: int = 4, rag_cache_size: int = 1024, rag_cache_threshold: float = 0.95,
+                  rag_cache_ttl_s: float | None = 24 * 3600, rag_hypo_cache_mb: float = 64, rag_hypo_cache_dir: str | None = None,
+                  rag_hypo_cache_disk_mb: float | None = 512, rag_speculative_budget_s: float = 2.0,
+                  services: Iterable[str] = all_services, warmup_rounds: int = 1, trace_log_path: str | None = None,
+                  traffic_sample_path: str | None = None, traffic_sample_rate: float = 0.01, worker_processes: Iterable[str] = (),
+                  asr_batch_size: int = 8, asr_batch_wait_ms: float = 5, asr_max_chunk_s: float = 30):
+    """
+    Serves the endpoints of services (any of "rag", "tts", "asr"); only their models are imported and loaded.
+    After startup every service runs warmup_rounds synthetic requests, and /health/ready reports ready once all are done.
+    Every HTTP response carries X-Trace-Id and Server-Timing headers; trace_log_path appends one JSON line per request.
+    traffic_sample_path records a traffic_sample_rate fraction of the requests as a corpus for load_test.py.
+    The services in worker_processes run their models in a process of their own (see backend.workers.WorkerProcess)
+    with the same concurrency settings; the others run on thread pools of this process.
+    Concurrent ASR requests are decoded together, up to asr_batch_size clips collected for up to asr_batch_wait_ms
+    (asr_batch_size 1 decodes every request on its own). Longer /asr uploads than asr_max_chunk_s are cut at pauses
+    into chunks decoded in parallel (0 decodes them in one pass).
+    """
+    global chat_model, vectorstore, tts_model, tts_config, asr_model
+    setproctitle.setproctitle('SJTU-Echo-Server')
+    services = set(services)
+    if not services or not services <= set(all_services):
+        raise ValueError(f"services must be a non-empty subset of {', '.join(all_services)}, got {', '.join(services)}")
+    worker_processes = set(worker_processes) & services
 
-    asr_model = get_asr_model()
+    # heavy imports (vllm, TTS, funasr) are only done for the services served in this process
+    loaders = {}
+    if "rag" in services:
+        from backend.messages import messages_to_json, json_to_messages, get_cacheable_question
+        rag_cached_inference, rag_prepare_inference, rag_warmup, hypo_cache_stats, speculative_retrieval_stats = _service_functions(
+            "backend.rag", ["cached_inference", "prepare_inference", "warmup", "hypo_cache_stats", "speculative_retrieval_stats"], "rag" in worker_processes)
+        if not chat_model_name.startswith("Qwen/"):
+            raise ValueError(f"Unknown chat model: {chat_model_name}")
+        loaders["rag"] = partial(_load_rag, chat_model_name, hf_vectorstore_source_dir, rag_strategy, llm_gpu_memory_utilization,
+                                 llm_max_num_seqs, rag_concurrency, rag_cache_size, rag_cache_threshold, rag_cache_ttl_s,
+                                 rag_hypo_cache_mb, rag_hypo_cache_dir, rag_hypo_cache_disk_mb, rag_speculative_budget_s)
+    if "tts" in services:
+        tts_inference, tts_stream_inference, tts_warmup, prefill_segment_cache, segment_cache_stats = _service_functions(
+            "backend.tts", ["inference", "stream_inference", "warmup", "prefill_segment_cache", "segment_cache_stats"], "tts" in worker_processes)
+        loaders["tts"] = partial(_load_tts, tts_cache_mb, tts_cache_dir, tts_cache_disk_mb, tts_batch_size)
+    if "asr" in services:
+        from backend.transcription import stitch_transcripts, StreamingSession as ASRStreamingSession
+        asr_inference, asr_transcribe_batch, asr_decode_input, asr_split_long_audio, asr_model_sample_rate, asr_warmup = _service_functions(
+            "backend.asr", ["inference", "transcribe_batch", "decode_input", "split_long_audio", "model_sample_rate", "warmup"],
+            "asr" in worker_processes)
+        loaders["asr"] = partial(_load_asr, asr_batch_size)
+
+    # one bounded pool (or worker process) per model family, so a slow endpoint only backs up its own queue;
+    # the rag pool only holds threads waiting on the async LLM engine, which batches their prompts together
+    concurrency = {"rag": rag_concurrency, "tts": tts_concurrency, "asr": asr_concurrency}
+    executors = {}
+    models = {}
+    start = timer()
+    # worker processes start first and load in parallel with everything else
+    for name in all_services:
+        if name in worker_processes:
+            executors[name] = WorkerProcess(name, loaders[name], concurrency[name], max_queue_size)
+    # the models are independent, and loading is mostly weight I/O and CUDA / ONNX initialization that release the GIL,
+    # so they load concurrently; vLLM profiles free GPU memory while the others load, which can only shrink its KV cache
+    local_services = [name for name in loaders if name not in worker_processes]
+    if local_services:
+        with ThreadPoolExecutor(max_workers=len(local_services), thread_name_prefix="model-loader") as pool:
+            futures = [pool.submit(loaders[name]) for name in local_services]
+            for future in futures:
+                models.update(future.result())
+        for name in local_services:
+            executors[name] = ModelExecutor(name, concurrency[name], max_queue_size)
+    # objects living in a worker process are passed to it by name
+    worker_models = {"rag": ("chat_model", "vectorstore", "answer_cache"), "tts": ("tts_model", "tts_config"), "asr": ("asr_model",)}
+    for name in worker_processes:
+        executors[name].wait_ready()
+        models.update({model: ModelRef(model) for model in worker_models[name]})
+    if "answer_cache" in models and rag_cache_size <= 0:
+        models["answer_cache"] = None
+    print(f"Models loaded in {timer() - start:.3f}s: {', '.join(loaders)}"
+          + (f" (worker processes: {', '.join(sorted(worker_processes))})" if worker_processes else ""))
+
+    chat_model, vectorstore, answer_cache = models.get("chat_model"), models.get("vectorstore"), models.get("answer_cache")
+    tts_model, tts_config = models.get("tts_model"), models.get("tts_config")
+    asr_model = models.get("asr_model")
+
+    async def run_in_executor(name: str, func, *args):
+        try:
+            return await executors[name].run(func, *args)
+        except (QueueFullError, WorkerUnavailableError) as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    async def iterate_in_executor(name: str, func, *args):
+        # a stream is admitted (or rejected with 503) once, before the response starts
+        try:
+            return await executors[name].iterate(func, *args)
+        except (QueueFullError, WorkerUnavailableError) as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    async def call_service(name: str, func, *args):
+        # cheap calls (stats, cache updates) run directly here, or in the service's worker process
+        if name in worker_processes:
+            return await run_in_executor(name, func, *args)
+        return func(*args)
 
     app = FastAPI()
-    app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
-    @app.post("/rag")
-    async def rag(request: Request):
-        messages_json = await request.json()
-        messages = json_to_messages(messages_json)
-        with timer_context("RAG inference"):
-            new_message, _ = rag_inference(messages, chat_model, vectorstore, rag_strategy)
-        return messages_to_json([new_message])
-    @app.post("/tts")
-    async def tts(request: Request):
-        data = await request.json()
-        text = data["text"]
-        with timer_context("TTS inference"):
-            result = tts_inference(text, tts_model, tts_config)
-        return StreamingResponse(result, media_type="application/octet-stream")
-    @app.post("/asr")
-    async def asr(request: Request):
-        data = await request.json()
-        sample_rate = data["sample_rate"]
-        audio_data = data["audio_data"]
-        with timer_context("ASR inference"):
-            result = asr_inference(audio_data, sample_rate, asr_model)
-        return Response(content=result, media_type="text/plain")
+    configure_trace_log(trace_log_path)
+    app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"],
+                       expose_headers=["X-Trace-Id", "Server-Timing"])
+    def route_label(request: Request):
+        # the route is only known after routing; unknown paths share one label to bound cardinality
+        return request.scope["route"].path if "route" in request.scope else "unmatched"
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        start = timer()
+        try:
+            response = await call_next(request)
+        except Exception:
+            requests_total.labels(route_label(request)).inc()
+            errors_total.labels(route_label(request)).inc()
+            raise
+        requests_total.labels(route_label(request)).inc()
+        if response.status_code >= 500:
+            errors_total.labels(route_label(request)).inc()
+        request_duration.labels(route_label(request)).observe(timer() - start)
+        return response
+    @app.middleware("http")
+    async def trace_requests(request: Request, call_next):
+        trace = start_trace(request.headers.get("x-trace-id"))
+        response = await call_next(request)
+        trace.endpoint = route_label(request)
+        # headers leave with the first byte, so streamed responses only time the stages before it;
+        # the trace is finished (and logged) when the body is done
+        response.headers["X-Trace-Id"] = trace.trace_id
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["Timing-Allow-Origin"] = "*"
+        body_iterator = response.body_iterator
+        async def body_with_trace():
+            try:
+                async for chunk in body_iterator:
+                    yield chunk
+            finally:
+                finish_trace(trace, response.status_code)
+        response.body_iterator = body_with_trace()
+        return response
+    traffic_sampler = TrafficSampler(traffic_sample_path, traffic_sample_rate) if traffic_sample_path else None
+    if traffic_sampler is not None:
+        @app.middleware("http")
+        async def sample_traffic(request: Request, call_next):
+            if request.method == "POST" and traffic_sampler.should_sample(request.url.path):
+                body = await request.body()
+                # written off the event loop and not awaited, so sampling adds no latency
+                asyncio.get_running_loop().run_in_executor(None, traffic_sampler.record, request.url.path,
+                                                           dict(request.headers), body, request.url.query)
+            return await call_next(request)
+    @app.get("/metrics")
+    async def metrics():
+        body, content_type = metrics_payload()
+        return Response(content=body, media_type=content_type)
+    if "rag" in services:
+        @app.post("/rag")
+        async def rag(request: Request):
+            with stage_timer("json_decode"):
+                messages = json_to_messages(await request.json())
+            new_message, _ = await run_in_executor("rag", rag_cached_inference, messages, chat_model, vectorstore, rag_strategy, answer_cache)
+            return messages_to_json([new_message])
+        def sse_event(event: str, data: dict):
+            return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        @app.post("/rag/stream")
+        async def rag_stream(request: Request):
+            """
+            Server-Sent Events: one "links" event, then "token" events with answer deltas, then "done" (or "error").
+            "done" carries the trace ID and the stage timing in milliseconds, which the Server-Timing header cannot
+            include for a streamed answer
+            """
+            trace = current_trace()
+            with stage_timer("json_decode"):
+                messages = json_to_messages(await request.json())
+            question = get_cacheable_question(messages) if answer_cache is not None else None
+            cached, question_embedding = None, None
+            if question is not None:
+                cached, question_embedding = await run_in_executor("rag", call_method, answer_cache, "lookup", question)
+                trace.annotate(answer_cached=cached is not None)
+            if cached is not None:
+                async def cached_events():
+                    yield sse_event("links", {"links": cached["links"]})
+                    yield sse_event("token", {"content": cached["content"]})
+                    yield sse_event("done", {"cached": True, "trace_id": trace.trace_id, "timing": trace.timing()})
+                return StreamingResponse(cached_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+            links, contexts, messages = await run_in_executor("rag", rag_prepare_inference, messages, chat_model, vectorstore, rag_strategy)
+            if "rag" in worker_processes:
+                answer_chunks = await iterate_in_executor("rag", call_method, chat_model, "stream", messages)
+            else:
+                answer_chunks = chat_model.astream(messages)
+            async def events():
+                yield sse_event("links", {"links": links})
+                content = []
+                try:
+                    with stage_timer("generation"):
+                        async for chunk in answer_chunks:
+                            record_generated_tokens(chunk)
+                            if chunk.usage_metadata:
+                                trace.annotate(prompt_tokens=chunk.usage_metadata["input_tokens"],
+                                               output_tokens=chunk.usage_metadata["output_tokens"])
+                            if chunk.content:
+                                content.append(chunk.content)
+                                yield sse_event("token", {"content": chunk.content})
+                    if question is not None:
+                        await call_service("rag", call_method, answer_cache, "put", question,
+                                           {"content": "".join(content), "links": links, "contexts": contexts}, question_embedding)
+                except Exception as e:
+                    errors_total.labels("/rag/stream").inc()
+                    yield sse_event("error", {"detail": str(e)})
+                    return
+                yield sse_event("done", {"trace_id": trace.trace_id, "timing": trace.timing()})
+            return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    if "tts" in services:
+        async def prefill_tts_cache():
+            if tts_cache_mb <= 0 or tts_cache_prefill_path is None:
+                return
+            with open(tts_cache_prefill_path) as f:
+                texts = [line.strip() for line in f if line.strip()]
+            # runs on the tts pool text by text, so it never jumps ahead of requests for long
+            for text in texts:
+                await executors["tts"].run(prefill_segment_cache, [text], tts_model, tts_config)
+            print(f"TTS segment cache prefilled with {len(texts)} texts")
+        @app.post("/tts")
+        async def tts(request: Request):
+            """
+            {"text": ..., "stream": false, "format": "wav", "sample_rate": 24000}
+            format: wav (32-bit float), wav-int16, pcm (raw int16), mp3 or ogg (Opus); sample_rate: 8000 to 48000
+            With "stream": true audio is sent segment by segment (wav is then sent as wav-int16 with a header of
+            unknown length), so playback can start after the first segment
+            """
+            with stage_timer("json_decode"):
+                data = await request.json()
+            text = data["text"]
+            output_format = data.get("format", "wav")
+            try:
+                sample_rate = int(data.get("sample_rate", 24000))
+                check_output_format(output_format, sample_rate)
+            except (TypeError, ValueError) as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if data.get("stream", False):
+                stream_format = "wav-int16" if output_format == "wav" else output_format
+                audio_chunks = await iterate_in_executor("tts", tts_stream_inference, text, tts_model, tts_config, stream_format, sample_rate)
+                return StreamingResponse(audio_chunks, media_type=output_media_types[stream_format])
+            result = await run_in_executor("tts", tts_inference, text, tts_model, tts_config, output_format, sample_rate)
+            media_type = "application/octet-stream" if output_format == "wav" else output_media_types[output_format]
+            return StreamingResponse(result, media_type=media_type)
+    asr_batcher = None
+    if "asr" in services:
+        if asr_batch_size > 1:
+            async def run_asr_batch(clips: list[tuple]):
+                return await run_in_executor("asr", asr_transcribe_batch, [audio for audio, _ in clips],
+                                             [sample_rate for _, sample_rate in clips], asr_model)
+            asr_batcher = MicroBatcher("asr", run_asr_batch, asr_batch_size, asr_batch_wait_ms / 1000)
+        async def transcribe(audio, sample_rate: float) -> str:
+            if asr_batcher is None:
+                return await run_in_executor("asr", asr_inference, audio, sample_rate, asr_model)
+            return await asr_batcher.submit((audio, sample_rate))
+        async def transcribe_long(audio: np.ndarray, sample_rate: float) -> dict:
+            if asr_max_chunk_s <= 0 or len(audio) <= asr_max_chunk_s * sample_rate:
+                return stitch_transcripts([await transcribe(audio, sample_rate)], [len(audio)], sample_rate)
+            # chunks are cut at pauses and decoded together, with each other and with concurrent requests
+            chunks, sample_rate = await run_in_executor("asr", asr_split_long_audio, audio, sample_rate, asr_max_chunk_s, asr_model)
+            annotate(asr_chunks=len(chunks))
+            if asr_batcher is None:
+                texts = await run_in_executor("asr", asr_transcribe_batch, chunks, [sample_rate] * len(chunks), asr_model)
+            else:
+                texts = await asyncio.gather(*[asr_batcher.submit((chunk, sample_rate)) for chunk in chunks])
+            return stitch_transcripts(texts, [len(chunk) for chunk in chunks], sample_rate)
+        def transcript_response(result: dict, timestamps: bool):
+            if timestamps:
+                return JSONResponse(result)
+            return Response(content=result["text"], media_type="text/plain")
+        @app.post("/asr")
+        async def asr(request: Request):
+            """
+            Accepts either JSON {"sample_rate", "audio_data": list[float]} or a binary body:
+            raw little-endian PCM (audio/pcm or application/octet-stream; sample rate from the X-Sample-Rate header or
+            sample_rate query parameter, sample format from X-PCM-Format or format: int16 (default) / float32),
+            WAV/FLAC/Ogg (audio/wav, audio/flac, audio/ogg) or WebM/MP4 (audio/webm, audio/mp4, decoded with ffmpeg)
+            Answers with the transcript as text, or with "timestamps" (JSON field or query parameter) as JSON
+            {"text", "segments": [{"start", "end", "text"}]}; audio longer than the max chunk length is cut at pauses
+            and its chunks are decoded in parallel
+            """
+            content_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+            if content_type == "application/json":
+                with stage_timer("json_decode"):
+                    data = await request.json()
+                sample_rate = data["sample_rate"]
+                audio_data = np.asarray(data["audio_data"], dtype=np.float32)
+                return transcript_response(await transcribe_long(audio_data, sample_rate), bool(data.get("timestamps", False)))
+            sample_rate = request.headers.get("x-sample-rate") or request.query_params.get("sample_rate")
+            pcm_format = request.headers.get("x-pcm-format") or request.query_params.get("format", "int16")
+            body = await request.body()
+            try:
+                sample_rate = float(sample_rate) if sample_rate else None
+                audio_data, sample_rate = await run_in_executor("asr", asr_decode_input, body, content_type, sample_rate, pcm_format)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            timestamps = request.query_params.get("timestamps", "false").lower() in ("1", "true")
+            return transcript_response(await transcribe_long(audio_data, sample_rate), timestamps)
+        @app.websocket("/asr/stream")
+        async def asr_stream(websocket: WebSocket):
+            """
+            Streaming ASR. The client sends a JSON config {"sample_rate": ..., "format": "int16" | "float32"},
+            then binary frames of raw little-endian mono PCM as they are recorded, then {"type": "end"}.
+            The server answers with "partial", "final" and "done" messages (see backend.asr.StreamingSession),
+            and closes with code 1011 if a segment could not be transcribed
+            """
+            await websocket.accept()
+            requests_total.labels("/asr/stream").inc()
+            session = None
+            try:
+                config = await websocket.receive_json()
+                sample_rate = float(config["sample_rate"])
+                pcm_format = config.get("format", "int16")
+                session = ASRStreamingSession(sample_rate, transcribe, websocket.send_json,
+                                              await call_service("asr", asr_model_sample_rate, asr_model))
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        break
+                    if message.get("bytes") is not None:
+                        await session.feed(decode_pcm(message["bytes"], pcm_format))
+                    elif message.get("text") is not None and json.loads(message["text"]).get("type") == "end":
+                        await session.finish()
+                        if session.failed_segments:
+                            errors_total.labels("/asr/stream").inc()
+                        await websocket.close(code=1011 if session.failed_segments else 1000)
+                        break
+            except WebSocketDisconnect:
+                pass
+            except (ValueError, KeyError) as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                await websocket.close(code=1003)
+            except Exception as e:
+                errors_total.labels("/asr/stream").inc()
+                try:
+                    await websocket.send_json({"type": "error", "detail": f"{type(e).__name__}: {e}"})
+                    await websocket.close(code=1011)
+                except Exception:
+                    # the connection is already gone
+                    pass
+            finally:
+                if session is not None:
+                    session.cancel()
+    @app.get("/status")
+    async def status():
+        result = {name: executor.stats() for name, executor in executors.items()}
+        if "rag" in services:
+            result["llm_batch"] = await call_service("rag", call_method, chat_model, "batch_stats")
+            result["rag_hypo_cache"] = await call_service("rag", hypo_cache_stats)
+            if rag_strategy == "speculative":
+                result["rag_speculative"] = await call_service("rag", speculative_retrieval_stats)
+            result["rag_answer_cache"] = await call_service("rag", call_method, answer_cache, "stats") if answer_cache is not None else None
+        if "tts" in services:
+            result["tts_cache"] = await call_service("tts", segment_cache_stats)
+        if asr_batcher is not None:
+            result["asr_batching"] = asr_batcher.stats()
+        if traffic_sampler is not None:
+            result["traffic_sampling"] = traffic_sampler.stats()
+        return result
+
+    warmups = {}
+    if "rag" in services:
+        warmups["rag"] = (rag_warmup, chat_model, vectorstore, hf_vectorstore_source_dir)
+    if "tts" in services:
+        warmups["tts"] = (tts_warmup, tts_model, tts_config)
+    if "asr" in services:
+        warmups["asr"] = (asr_warmup, asr_model)
+    warmup_status = {name: "warming_up" if warmup_rounds > 0 else "ready" for name in warmups}
+    for name in worker_processes:
+        # a worker process started again after a crash warms itself up before it takes requests
+        executors[name].warmup = (warmups[name][0], warmups[name][1:], warmup_rounds)
+    @app.on_event("startup")
+    async def start_warmup():
+        async def warm(name: str, func, *args):
+            try:
+                start = timer()
+                for _ in range(warmup_rounds):
+                    await executors[name].run(func, *args)
+            except Exception as e:
+                warmup_status[name] = f"failed: {e}"
+                return
+            warmup_status[name] = "ready"
+            print(f"{name} warmed up in {timer() - start:.3f}s")
+            if name == "tts":
+                await prefill_tts_cache()
+        # in the background, so that /health/live answers while the pipelines warm up concurrently
+        for name, (func, *args) in warmups.items():
+            asyncio.create_task(warm(name, func, *args))
+    @app.on_event("shutdown")
+    def stop_executors():
+        # worker processes are not daemons, so they have to be stopped before this process can exit
+        for executor in executors.values():
+            executor.shutdown()
+    @app.get("/health/live")
+    async def health_live():
+        return {"status": "alive"}
+    @app.get("/health/ready")
+    async def health_ready():
+        """
+        200 once every service has warmed up, 503 before (or if a warmup failed, or while a crashed worker process
+        is restarting), with the status of each service
+        """
+        status = {
+            name: "restarting" if warmup_status[name] == "ready" and not executors[name].stats().get("alive", True) else warmup_status[name]
+            for name in warmup_status
+        }
+        ready = all(service_status == "ready" for service_status in status.values())
+        return JSONResponse({"ready": ready, "services": status}, status_code=200 if ready else 503)
 
     host = "127.0.0.1"
     uvicorn.run(app, host=host, port=port, log_level="info")
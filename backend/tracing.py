@@ -0,0 +1,118 @@
+import contextvars
+import json
+import logging
+import time
+import uuid
+from threading import Lock
+from timeit import default_timer as timer
+from typing import Any
+
+# stages shown together in the Server-Timing header; the trace log keeps them apart
+_server_timing_names = {
+    "hyde_generation": "hyde",
+    "query_embedding": "retrieve",
+    "vector_search": "retrieve",
+    "generation": "generate",
+    "tts_segment": "tts_segments",
+}
+
+class Trace:
+    """
+    Timing and attributes of one request. Stages recorded several times (e.g. once per TTS segment) add up.
+    """
+    def __init__(self, trace_id: str, endpoint: str = ""):
+        self.trace_id = trace_id
+        self.endpoint = endpoint
+        self.start_time = time.time()
+        self._start = timer()
+        self._lock = Lock()
+        self.stages = {}
+        self.attributes = {}
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def annotate(self, **attributes: Any):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def elapsed(self) -> float:
+        return timer() - self._start
+
+    def timing(self) -> dict:
+        """
+        returns milliseconds by Server-Timing name
+        """
+        with self._lock:
+            timing = {}
+            for stage, seconds in self.stages.items():
+                name = _server_timing_names.get(stage, stage)
+                timing[name] = timing.get(name, 0.0) + seconds * 1000
+        return {name: round(ms, 1) for name, ms in timing.items()}
+
+    def server_timing(self) -> str:
+        return ", ".join([f"{name};dur={ms}" for name, ms in self.timing().items()] + [f"total;dur={self.elapsed() * 1000:.1f}"])
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "trace_id": self.trace_id,
+                "endpoint": self.endpoint,
+                "start_time": self.start_time,
+                "duration_ms": round(self.elapsed() * 1000, 1),
+                "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+                **self.attributes,
+            }
+
+logger = logging.getLogger(__name__)
+_current_trace = contextvars.ContextVar("trace", default=None)
+_trace_log_path = None
+_trace_log_lock = Lock()
+
+def configure_trace_log(path: str | None):
+    """
+    Appends one JSON line per finished request to path (None disables the log); the one-line summary of every
+    request is logged at INFO by the backend.tracing logger either way
+    """
+    global _trace_log_path
+    _trace_log_path = path
+    if not logger.handlers and not logging.getLogger().handlers:
+        # without a logging config of the application's own, the per-request line goes to stderr next to uvicorn's log
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+
+def start_trace(trace_id: str | None = None, endpoint: str = "") -> Trace:
+    """
+    Starts the trace of the current request (keeping the caller's trace ID if given) and makes it current
+    """
+    trace = Trace(trace_id or uuid.uuid4().hex, endpoint)
+    _current_trace.set(trace)
+    return trace
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+def record_stage(stage: str, seconds: float):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_stage(stage, seconds)
+
+def annotate(**attributes: Any):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.annotate(**attributes)
+
+def finish_trace(trace: Trace, status: int):
+    trace.annotate(status=status)
+    record = trace.to_dict()
+    logger.info("[trace %s] %s %s %.1fms", trace.trace_id, trace.endpoint, status, record["duration_ms"])
+    if _trace_log_path is None:
+        return
+    with _trace_log_lock:
+        with open(_trace_log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
@@ -0,0 +1,65 @@
+import base64
+import json
+import random
+import time
+from threading import Lock
+
+# request headers needed to replay a request; everything else (cookies, auth, ...) is dropped
+replayed_headers = ("content-type", "x-sample-rate", "x-pcm-format")
+sampled_endpoints = ("/rag", "/rag/stream", "/tts", "/asr")
+
+def encode_request(endpoint: str, headers: dict, body: bytes, query: str = "", timestamp: float | None = None) -> dict:
+    """
+    One line of a request corpus: JSON bodies are kept readable under "json", others base64-encoded under "body_b64"
+    """
+    headers = {name.lower(): value for name, value in headers.items() if name.lower() in replayed_headers}
+    record = {"time": timestamp if timestamp is not None else time.time(), "endpoint": endpoint, "query": query, "headers": headers}
+    content_type = headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    if content_type == "application/json":
+        try:
+            record["json"] = json.loads(body)
+            return record
+        except ValueError:
+            pass
+    record["body_b64"] = base64.b64encode(body).decode("ascii")
+    return record
+
+def decode_request(record: dict) -> tuple[str, dict, bytes]:
+    """
+    returns (endpoint with query string, headers, body) of a corpus line
+    """
+    endpoint = record["endpoint"] + (f"?{record['query']}" if record.get("query") else "")
+    headers = dict(record.get("headers", {}))
+    if "json" in record:
+        headers.setdefault("content-type", "application/json")
+        return endpoint, headers, json.dumps(record["json"], ensure_ascii=False).encode("utf-8")
+    return endpoint, headers, base64.b64decode(record["body_b64"])
+
+def load_corpus(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class TrafficSampler:
+    """
+    Appends a random sample_rate fraction of the requests to sampled_endpoints to a corpus file, for replay with
+    load_test.py
+    """
+    def __init__(self, path: str, sample_rate: float):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._lock = Lock()
+        self._sampled = 0
+
+    def should_sample(self, endpoint: str) -> bool:
+        return endpoint in sampled_endpoints and random.random() < self.sample_rate
+
+    def record(self, endpoint: str, headers: dict, body: bytes, query: str = ""):
+        line = json.dumps(encode_request(endpoint, headers, body, query), ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self._sampled += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"path": self.path, "sample_rate": self.sample_rate, "sampled": self._sampled}
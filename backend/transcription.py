@@ -0,0 +1,113 @@
+import asyncio
+import numpy as np
+from backend.audio import StreamingResampler
+from backend.vad import EnergyVAD
+from backend.metrics import stage_timer
+
+# the parts of ASR that run around the model calls, without the model libraries, so that a front-end process handing
+# ASR to a worker process does not import them
+
+def stitch_transcripts(texts: list[str], chunk_lengths: list[int], sample_rate: float) -> dict:
+    """
+    Joins the transcripts of consecutive chunks
+    returns {"text", "segments": [{"start", "end", "text"}]} with times in seconds
+    """
+    segments = []
+    start = 0
+    for text, length in zip(texts, chunk_lengths):
+        segments.append({"start": round(start / sample_rate, 2), "end": round((start + length) / sample_rate, 2), "text": text})
+        start += length
+    return {"text": "".join(texts), "segments": segments}
+
+class StreamingSession:
+    """
+    One streaming ASR connection: audio frames are segmented with EnergyVAD and every finished segment is
+    transcribed while the user keeps talking.
+    transcribe(audio, sample_rate) is an async callable running inference; send(dict) delivers a message to the client:
+    {"type": "partial", "index", "text"}: hypothesis for the segment still being spoken
+    {"type": "final", "index", "start", "end", "text"}: transcript of a finished segment, sent in segment order
+    {"type": "error", "index", "detail"}: a finished segment could not be transcribed (it is left out of the transcript)
+    {"type": "done", "text"}: whole transcript, after finish()
+    With target_sample_rate (the model's rate), frames are resampled as they arrive, so segments and partial
+    hypotheses reach the model without being resampled again.
+    """
+    def __init__(self, sample_rate: float, transcribe, send, target_sample_rate: float | None = None,
+                 partial_interval_s: float = 1.0, **vad_kwargs):
+        self._resampler = None
+        if target_sample_rate is not None and target_sample_rate != sample_rate:
+            self._resampler = StreamingResampler(sample_rate, target_sample_rate)
+            sample_rate = target_sample_rate
+        self.sample_rate = sample_rate
+        self._transcribe = transcribe
+        self._send = send
+        self._vad = EnergyVAD(sample_rate, **vad_kwargs)
+        self._partial_interval = int(partial_interval_s * sample_rate)
+        self._next_partial_len = self._partial_interval
+        self._partial_task = None
+        self._last_final_task = None
+        self._texts = []
+        self.failed_segments = 0
+
+    async def _finalize_segment(self, index: int, start: float, audio: np.ndarray, previous_task):
+        # decode concurrently with earlier segments, but send in order; a failed segment does not stop the later ones
+        error = None
+        try:
+            text = await self._transcribe(audio, self.sample_rate)
+        except Exception as e:
+            error = e
+        if previous_task is not None:
+            await previous_task
+        if error is not None:
+            self.failed_segments += 1
+            await self._send({"type": "error", "index": index, "detail": f"{type(error).__name__}: {error}"})
+            return
+        self._texts[index] = text
+        await self._send({"type": "final", "index": index, "start": start, "end": start + len(audio) / self.sample_rate, "text": text})
+
+    async def _send_partial(self, index: int, audio: np.ndarray):
+        try:
+            text = await self._transcribe(audio, self.sample_rate)
+        except Exception:
+            # the final transcript of the segment reports the error
+            return
+        if index == len(self._texts):
+            await self._send({"type": "partial", "index": index, "text": text})
+
+    def _start_final(self, start: float, audio: np.ndarray):
+        self._texts.append("")
+        self._last_final_task = asyncio.create_task(self._finalize_segment(len(self._texts) - 1, start, audio, self._last_final_task))
+        self._next_partial_len = self._partial_interval
+
+    async def feed(self, audio: np.ndarray):
+        if self._resampler is not None:
+            with stage_timer("asr_resample"):
+                audio = self._resampler.process(audio)
+        for start, segment in self._vad.process(audio):
+            self._start_final(start, segment)
+        if not self._vad.in_speech or (self._partial_task is not None and not self._partial_task.done()):
+            return
+        current = self._vad.current_segment()
+        if len(current) >= self._next_partial_len:
+            self._next_partial_len = len(current) + self._partial_interval
+            self._partial_task = asyncio.create_task(self._send_partial(len(self._texts), current))
+
+    def cancel(self):
+        for task in (self._partial_task, self._last_final_task):
+            if task is not None:
+                task.cancel()
+
+    async def finish(self) -> str:
+        if self._resampler is not None:
+            for start, segment in self._vad.process(self._resampler.flush()):
+                self._start_final(start, segment)
+        for start, segment in self._vad.flush():
+            self._start_final(start, segment)
+        if self._partial_task is not None:
+            # the hypothesis is superseded by the final transcript
+            self._partial_task.cancel()
+            await asyncio.gather(self._partial_task, return_exceptions=True)
+        if self._last_final_task is not None:
+            await self._last_final_task
+        text = "".join(self._texts)
+        await self._send({"type": "done", "text": text})
+        return text
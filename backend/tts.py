@@ -1,10 +1,21 @@
 import re
+import hashlib
+import pickle
+import numpy as np
 import torchaudio
 from io import BytesIO
-from torch import tensor, cat
+import torch
+import torch.nn.functional as F
+from torch import tensor
 from TTS.tts.configs.xtts_config import XttsConfig
 from TTS.tts.models.xtts import Xtts
 from ml_web_inference import get_proper_device
+from backend.audio import encode_audio, resample_audio, check_output_format, StreamEncoder, OutputFormat
+from backend.cache import LRUCache
+from backend.metrics import stage_timer, observe_stage, add_audio_seconds
+from backend.tracing import annotate
+from timeit import default_timer as timer
+from typing import Iterator
 import os
 
 def _get_wav_path(path):
@@ -25,56 +36,203 @@ def _detect_language(text):
         return "ja"
     return "unknown"
     
-def get_tts_model_and_config():
+_checkpoint_dir = "ckpts/xttsv2"
+_gpt_cond_len = 10
+# (gpt_cond_latent, speaker_embedding) per language, computed once in get_tts_model_and_config
+_lang_to_conditioning_latents = {}
+# identifies the loaded checkpoint in segment cache keys, set in get_tts_model_and_config
+_model_version = None
+# PCM of synthesized segments, see configure_segment_cache
+_segment_cache = None
+
+def _compute_model_version():
+    digest = hashlib.sha1()
+    with open(f"{_checkpoint_dir}/config.json", "rb") as f:
+        digest.update(f.read())
+    checkpoint_path = f"{_checkpoint_dir}/model.pth"
+    if os.path.exists(checkpoint_path):
+        digest.update(f"{os.path.getsize(checkpoint_path)}:{os.path.getmtime(checkpoint_path)}".encode())
+    return digest.hexdigest()[:12]
+
+def _load_or_compute_conditioning_latents(model, speaker_wav: str, latents_dir: str | None):
+    latents_path = None
+    if latents_dir is not None:
+        latents_path = os.path.join(latents_dir, os.path.splitext(os.path.basename(speaker_wav))[0] + f"_cond{_gpt_cond_len}.pt")
+        if os.path.exists(latents_path):
+            # weights_only: a tampered file cannot run code; files of an older format are recomputed
+            try:
+                saved = torch.load(latents_path, map_location=model.device, weights_only=True)
+            except (OSError, RuntimeError, EOFError, pickle.UnpicklingError):
+                saved = {}
+            # latents are only valid for the reference wav and the checkpoint they were computed with
+            if (saved.get("speaker_wav_mtime") == os.path.getmtime(speaker_wav)
+                    and saved.get("model_version") == _model_version):
+                return saved["gpt_cond_latent"], saved["speaker_embedding"]
+    # same settings Xtts.synthesize uses for a speaker_wav
+    gpt_cond_latent, speaker_embedding = model.get_conditioning_latents(
+        audio_path=speaker_wav,
+        gpt_cond_len=_gpt_cond_len,
+        gpt_cond_chunk_len=6,
+        max_ref_length=10,
+        sound_norm_refs=False
+    )
+    if latents_path is not None:
+        os.makedirs(latents_dir, exist_ok=True)
+        torch.save({
+            "gpt_cond_latent": gpt_cond_latent,
+            "speaker_embedding": speaker_embedding,
+            "speaker_wav_mtime": os.path.getmtime(speaker_wav),
+            "model_version": _model_version,
+        }, latents_path)
+    return gpt_cond_latent, speaker_embedding
+
+def get_tts_model_and_config(save_latents: bool = True):
+    """
+    Loads XTTS and precomputes the speaker conditioning latents of every language's reference wav,
+    saved under ckpts/xttsv2/speaker_latents unless save_latents is False
+    """
     config = XttsConfig()
-    config.load_json("ckpts/xttsv2/config.json")
+    config.load_json(f"{_checkpoint_dir}/config.json")
     model = Xtts.init_from_config(config)
-    model.load_checkpoint(config, checkpoint_dir="ckpts/xttsv2", eval=True)
+    model.load_checkpoint(config, checkpoint_dir=_checkpoint_dir, eval=True)
     model.to(get_proper_device(2000))
+    global _model_version
+    _model_version = _compute_model_version()
+    latents_dir = os.path.join(_checkpoint_dir, "speaker_latents") if save_latents else None
+    for lang, speaker_wav in _lang_to_sample_path.items():
+        _lang_to_conditioning_latents[lang] = _load_or_compute_conditioning_latents(model, speaker_wav, latents_dir)
     return model, config
     
 def _get_result_arr(text: str, model, config, lang: str):
-    result_dict = model.synthesize(
+    gpt_cond_latent, speaker_embedding = _lang_to_conditioning_latents[lang]
+    result_dict = model.inference(
         text,
-        config,
-        speaker_wav=_lang_to_sample_path[lang],
-        language=lang,
-        gpt_cond_len=10
+        lang,
+        gpt_cond_latent,
+        speaker_embedding,
+        temperature=config.temperature,
+        length_penalty=config.length_penalty,
+        repetition_penalty=config.repetition_penalty,
+        top_k=config.top_k,
+        top_p=config.top_p
     )
     return tensor(result_dict["wav"])
 
+def _synthesize_batch(texts: list[str], model, config, lang: str) -> list[np.ndarray]:
+    """
+    Synthesizes several segments of one language/speaker with a single autoregressive GPT run:
+    the conditioned text prefixes are left-padded to the same length and masked, then each sample's codes
+    are cut at its stop token and decoded separately (same steps as Xtts.inference for one text).
+    """
+    if len(texts) == 1:
+        return [_get_result_arr(texts[0], model, config, lang).numpy()]
+    gpt = model.gpt
+    gpt_cond_latent, speaker_embedding = _lang_to_conditioning_latents[lang]
+    gpt_cond_latent = gpt_cond_latent.to(model.device)
+    speaker_embedding = speaker_embedding.to(model.device)
+    all_text_tokens = [
+        torch.IntTensor(model.tokenizer.encode(text.strip().lower(), lang=lang.split("-")[0])).unsqueeze(0).to(model.device)
+        for text in texts
+    ]
+    with torch.no_grad():
+        prefix_embs = []
+        for text_tokens in all_text_tokens:
+            text_inputs = F.pad(text_tokens, (0, 1), value=gpt.stop_text_token)
+            text_inputs = F.pad(text_inputs, (1, 0), value=gpt.start_text_token)
+            text_emb = gpt.text_embedding(text_inputs) + gpt.text_pos_embedding(text_inputs)
+            prefix_embs.append(torch.cat([gpt_cond_latent, text_emb], dim=1))
+        prefix_len = max(emb.shape[1] for emb in prefix_embs)
+        attention_mask = torch.ones((len(texts), prefix_len + 1), dtype=torch.long, device=model.device)
+        for i, emb in enumerate(prefix_embs):
+            attention_mask[i, :prefix_len - emb.shape[1]] = 0
+            prefix_embs[i] = F.pad(emb, (0, 0, prefix_len - emb.shape[1], 0))
+        gpt.gpt_inference.store_prefix_emb(torch.cat(prefix_embs, dim=0))
+        gpt_inputs = torch.full((len(texts), prefix_len + 1), fill_value=1, dtype=torch.long, device=model.device)
+        gpt_inputs[:, -1] = gpt.start_audio_token
+        generated = gpt.gpt_inference.generate(
+            gpt_inputs,
+            attention_mask=attention_mask,
+            bos_token_id=gpt.start_audio_token,
+            pad_token_id=gpt.stop_audio_token,
+            eos_token_id=gpt.stop_audio_token,
+            max_length=gpt.max_gen_mel_tokens + gpt_inputs.shape[-1],
+            do_sample=True,
+            top_p=config.top_p,
+            top_k=config.top_k,
+            temperature=config.temperature,
+            num_return_sequences=1,
+            num_beams=1,
+            length_penalty=config.length_penalty,
+            repetition_penalty=config.repetition_penalty,
+            output_attentions=False
+        )[:, gpt_inputs.shape[-1]:]
+        wavs = []
+        for text_tokens, gpt_codes in zip(all_text_tokens, generated):
+            stop_positions = (gpt_codes == gpt.stop_audio_token).nonzero()
+            if len(stop_positions):
+                gpt_codes = gpt_codes[:stop_positions[0, 0] + 1]
+            gpt_codes = gpt_codes.unsqueeze(0)
+            expected_output_len = torch.tensor([gpt_codes.shape[-1] * gpt.code_stride_len], device=model.device)
+            text_len = torch.tensor([text_tokens.shape[-1]], device=model.device)
+            gpt_latents = gpt(text_tokens, text_len, gpt_codes, expected_output_len, cond_latents=gpt_cond_latent,
+                              return_attentions=False, return_latent=True)
+            wavs.append(model.hifigan_decoder(gpt_latents, g=speaker_embedding).cpu().squeeze().numpy())
+    return wavs
+
+def _greedy_groups(lengths: list[int], cap: int) -> list[int]:
+    """
+    returns the group index of each part when consecutive parts are filled up to cap (longer parts stand alone)
+    """
+    groups, current = [], 0
+    for length in lengths:
+        if not groups or current + length > cap:
+            groups.append(len(groups) and groups[-1] + 1)
+            current = 0
+        else:
+            groups.append(groups[-1])
+        current += length
+    return groups
+
+def _balance_parts(parts: list[str], lengths: list[int], threshold: int) -> list[list[str]]:
+    """
+    Groups consecutive parts into as many segments as greedy filling up to threshold gives, with the longest
+    segment as short as possible (a batch is padded to its longest segment); parts longer than threshold stand alone
+    """
+    if not parts:
+        return []
+    num_segments = _greedy_groups(lengths, threshold)[-1] + 1
+    # the smallest cap that still fits the parts into num_segments segments
+    low, high = 1, threshold
+    while low < high:
+        cap = (low + high) // 2
+        if _greedy_groups(lengths, cap)[-1] + 1 <= num_segments:
+            high = cap
+        else:
+            low = cap + 1
+    groups = []
+    for part, group in zip(parts, _greedy_groups(lengths, low)):
+        if group == len(groups):
+            groups.append([])
+        groups[-1].append(part)
+    return groups
+
 def _split_text_multilang(text, threshold, lang='zh'):
-    if lang == 'zh' or lang == 'jp':
+    if lang in ('zh', 'ja', 'jp'):
         sentences = re.split(r'(，|。|！|？|；|：|…)', text)
-        segments = []
-        temp_segment = ""
+        parts = []
         for i in range(0, len(sentences), 2):
             if i + 1 < len(sentences):
                 part = sentences[i] + sentences[i + 1]
             else:
                 part = sentences[i]
-            if len(temp_segment) + len(part) <= threshold:
-                temp_segment += part
-            else:
-                if temp_segment:
-                    segments.append(temp_segment)
-                temp_segment = part
-        if temp_segment:
-            segments.append(temp_segment)
+            if part:
+                parts.append(part)
+        segments = ["".join(group) for group in _balance_parts(parts, [len(part) for part in parts], threshold)]
 
     elif lang == 'en':
+        # threshold counts words for english
         words = text.split()
-        segments = []
-        temp_segment = []
-        for word in words:
-            if len(temp_segment) + 1 <= threshold:
-                temp_segment.append(word)
-            else:
-                if temp_segment:
-                    segments.append(' '.join(temp_segment))
-                temp_segment = [word]
-        if temp_segment:
-            segments.append(' '.join(temp_segment))
+        segments = [' '.join(group) for group in _balance_parts(words, [1] * len(words), threshold)]
 
     else:
         segments = [text]
@@ -88,14 +246,134 @@ _lang_segment_threshold = {
     "zh": 40,
     "ja": 40,
 }
-def inference(text: str, model, config):
+_sample_rate = 24000
+def _get_text_segments(text: str):
     lang = _detect_language(text)
-    text_segments = _split_text_multilang(text, _lang_segment_threshold[lang], lang)
-    result_arrs = []
-    for segment in text_segments:
-        result_arrs.append(_get_result_arr(segment, model, config, lang))
-    result_arr = cat(result_arrs)
-    result = BytesIO()
-    torchaudio.save(result, result_arr.unsqueeze(0), 24000, format="wav")
-    result.seek(0)
-    return result
\ No newline at end of file
+    return lang, _split_text_multilang(text, _lang_segment_threshold[lang], lang)
+
+def configure_segment_cache(max_memory_mb: float = 256, disk_dir: str | None = None, max_disk_mb: float | None = None):
+    """
+    Caches the PCM of every synthesized segment by (normalized text, language, speaker, model version):
+    an LRU bounded to max_memory_mb, plus an optional on-disk tier in disk_dir bounded to max_disk_mb
+    """
+    global _segment_cache
+    _segment_cache = LRUCache(
+        int(max_memory_mb * 2**20),
+        disk_dir=disk_dir,
+        max_disk_bytes=int(max_disk_mb * 2**20) if max_disk_mb is not None else None
+    )
+
+def segment_cache_stats():
+    return _segment_cache.stats() if _segment_cache is not None else None
+
+def _normalize_segment(text: str):
+    return " ".join(text.split())
+
+_max_batch_size = 4
+def configure_batch_synthesis(max_batch_size: int = 4):
+    """
+    Maximum number of segments synthesized together; 1 synthesizes one segment at a time
+    """
+    global _max_batch_size
+    _max_batch_size = max(1, max_batch_size)
+
+def _segment_cache_key(segment: str, lang: str):
+    return (_normalize_segment(segment), lang, os.path.basename(_lang_to_sample_path[lang]), _model_version)
+
+def _synthesize_segments(segments: list[str], model, config, lang: str) -> Iterator[np.ndarray]:
+    """
+    Yields the audio of each segment in order: cached segments directly, the others in batches of
+    consecutive segments (similar in length, as _split_text_multilang balances them). The first missing segment
+    is synthesized alone so that streaming gets its first audio as early as possible.
+    """
+    results = [None] * len(segments)
+    missing = []
+    for i, segment in enumerate(segments):
+        if _segment_cache is not None:
+            results[i] = _segment_cache.get(_segment_cache_key(segment, lang))
+        if results[i] is None:
+            missing.append(i)
+    batches = []
+    annotate(tts_segments=len(segments), tts_cached_segments=len(segments) - len(missing))
+    if missing:
+        batches = [missing[:1]] + [missing[j:j+_max_batch_size] for j in range(1, len(missing), _max_batch_size)]
+    next_index = 0
+    for batch in batches:
+        start = timer()
+        wavs = _synthesize_batch([segments[i] for i in batch], model, config, lang)
+        # segments of a batch are synthesized together, so each one is accounted an equal share
+        for _ in batch:
+            observe_stage("tts_segment", (timer() - start) / len(batch))
+        for i, audio in zip(batch, wavs):
+            results[i] = audio.astype(np.float32)
+            if _segment_cache is not None:
+                _segment_cache.put(_segment_cache_key(segments[i], lang), results[i])
+        while next_index < len(segments) and results[next_index] is not None:
+            add_audio_seconds("tts", len(results[next_index]) / _sample_rate)
+            yield results[next_index]
+            next_index += 1
+    while next_index < len(segments):
+        add_audio_seconds("tts", len(results[next_index]) / _sample_rate)
+        yield results[next_index]
+        next_index += 1
+
+def prefill_segment_cache(texts: list[str], model, config):
+    """
+    Synthesizes the segments of frequent texts (greetings, boilerplate) ahead of time
+    """
+    for text in texts:
+        lang, text_segments = _get_text_segments(text)
+        for _ in _synthesize_segments(text_segments, model, config, lang):
+            pass
+
+_warmup_texts = {
+    "en": ["Hello, how can I help you?", "Thank you."],
+    "zh": ["你好，请问有什么可以帮您？", "谢谢。"],
+    "ja": ["こんにちは、ご用件は何ですか？", "ありがとう。"],
+}
+def warmup(model, config):
+    """
+    Runs single and batched synthesis once per language, bypassing the segment cache, so that the first requests
+    do not pay for CUDA kernel selection and allocator growth
+    """
+    for lang, texts in _warmup_texts.items():
+        _synthesize_batch(texts[:1], model, config, lang)
+        if _max_batch_size > 1:
+            _synthesize_batch(texts, model, config, lang)
+
+def inference(text: str, model, config, output_format: OutputFormat = "wav", sample_rate: int | None = None):
+    """
+    returns a BytesIO with the whole utterance encoded as output_format at sample_rate (default: the model's 24 kHz)
+    """
+    sample_rate = sample_rate or _sample_rate
+    check_output_format(output_format, sample_rate)
+    lang, text_segments = _get_text_segments(text)
+    result_arr = np.concatenate(list(_synthesize_segments(text_segments, model, config, lang)))
+    with stage_timer("tts_encode"):
+        if output_format == "wav" and sample_rate == _sample_rate:
+            result = BytesIO()
+            torchaudio.save(result, torch.from_numpy(result_arr).unsqueeze(0), _sample_rate, format="wav")
+            result.seek(0)
+            return result
+        return BytesIO(encode_audio(resample_audio(result_arr, _sample_rate, sample_rate), sample_rate, output_format))
+
+def stream_inference(text: str, model, config, output_format: OutputFormat = "wav-int16", sample_rate: int | None = None) -> Iterator[bytes]:
+    """
+    Yields the stream header (a WAV header of unknown length for wav formats), then each text segment's audio
+    encoded as soon as it is synthesized
+    """
+    sample_rate = sample_rate or _sample_rate
+    check_output_format(output_format, sample_rate)
+    encoder = StreamEncoder(_sample_rate, sample_rate, output_format)
+    lang, text_segments = _get_text_segments(text)
+    header = encoder.header()
+    if header:
+        yield header
+    for audio in _synthesize_segments(text_segments, model, config, lang):
+        with stage_timer("tts_encode"):
+            chunk = encoder.encode(audio)
+        if chunk:
+            yield chunk
+    trailer = encoder.close()
+    if trailer:
+        yield trailer
@@ -0,0 +1,139 @@
+import numpy as np
+
+class EnergyVAD:
+    """
+    Frame-energy voice activity detector for streaming audio.
+    A frame is speech when its RMS level is threshold_db above the estimated noise floor (and above min_level_db).
+    A segment starts after min_speech_ms of speech and ends after min_silence_ms of silence,
+    or when it reaches max_segment_s.
+    """
+    def __init__(self, sample_rate: float, frame_ms: float = 30, threshold_db: float = 12, min_level_db: float = -50,
+                 min_speech_ms: float = 90, min_silence_ms: float = 400, padding_ms: float = 200, max_segment_s: float = 20):
+        self.sample_rate = sample_rate
+        self.frame_len = int(sample_rate * frame_ms / 1000)
+        self.threshold_db = threshold_db
+        self.min_level_db = min_level_db
+        self.min_speech_frames = max(1, round(min_speech_ms / frame_ms))
+        self.min_silence_frames = max(1, round(min_silence_ms / frame_ms))
+        self.padding_frames = round(padding_ms / frame_ms)
+        self.max_segment_frames = int(max_segment_s * 1000 / frame_ms)
+        # the floor starts low and adapts upwards, so a stream starting with speech does not take it for noise
+        self._noise_db = min_level_db
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._frames = []
+        self._in_speech = False
+        self._speech_run = 0
+        self._silence_run = 0
+        self._segment_start_frame = 0
+        self._num_frames = 0
+
+    def _keep_last_frames(self, num_frames: int):
+        self._frames = self._frames[max(len(self._frames) - num_frames, 0):] if num_frames > 0 else []
+
+    def _frame_level_db(self, frame: np.ndarray) -> float:
+        return 10 * np.log10(np.mean(np.square(frame, dtype=np.float64)) + 1e-10)
+
+    def _is_speech(self, level_db: float) -> bool:
+        is_speech = level_db > max(self._noise_db + self.threshold_db, self.min_level_db)
+        # track the noise floor slowly, and faster downwards; speech frames only nudge it up, so that steady
+        # background noise louder than the initial floor is still learned eventually
+        if not is_speech:
+            rate = 0.3 if level_db < self._noise_db else 0.05
+        else:
+            rate = 0.005
+        self._noise_db += rate * (level_db - self._noise_db)
+        return is_speech
+
+    @property
+    def in_speech(self) -> bool:
+        return self._in_speech
+
+    def current_segment(self) -> np.ndarray:
+        """
+        Audio of the segment in progress (empty when not in speech)
+        """
+        if not self._in_speech or not self._frames:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(self._frames)
+
+    def _finish_segment(self):
+        audio = np.concatenate(self._frames)
+        start = self._segment_start_frame * self.frame_len / self.sample_rate
+        self._keep_last_frames(self.padding_frames)
+        self._in_speech = False
+        self._speech_run = 0
+        self._silence_run = 0
+        return start, audio
+
+    def process(self, audio: np.ndarray) -> list[tuple[float, np.ndarray]]:
+        """
+        Feeds audio and returns the segments finished by it, as (start_seconds, audio)
+        """
+        segments = []
+        audio = np.concatenate([self._pending, np.asarray(audio, dtype=np.float32)])
+        num_full = len(audio) // self.frame_len
+        self._pending = audio[num_full * self.frame_len:]
+        for i in range(num_full):
+            frame = audio[i * self.frame_len:(i + 1) * self.frame_len]
+            is_speech = self._is_speech(self._frame_level_db(frame))
+            self._frames.append(frame)
+            self._num_frames += 1
+            if not self._in_speech:
+                self._speech_run = self._speech_run + 1 if is_speech else 0
+                if self._speech_run >= self.min_speech_frames:
+                    self._in_speech = True
+                    self._silence_run = 0
+                    self._keep_last_frames(self._speech_run + self.padding_frames)
+                    self._segment_start_frame = self._num_frames - len(self._frames)
+                else:
+                    # only keep the leading padding while waiting for speech
+                    self._keep_last_frames(self._speech_run + self.padding_frames)
+                continue
+            self._silence_run = 0 if is_speech else self._silence_run + 1
+            if self._silence_run >= self.min_silence_frames or len(self._frames) >= self.max_segment_frames:
+                segments.append(self._finish_segment())
+        return segments
+
+    def flush(self) -> list[tuple[float, np.ndarray]]:
+        """
+        Ends the stream and returns the unfinished segment, if any
+        """
+        if self._pending.size:
+            self._frames.append(self._pending)
+            self._pending = np.zeros(0, dtype=np.float32)
+        if self._in_speech and self._frames:
+            return [self._finish_segment()]
+        return []
+
+def split_at_silences(audio: np.ndarray, sample_rate: float, max_chunk_s: float, frame_ms: float = 30,
+                      smoothing_frames: int = 5) -> list[tuple[int, int]]:
+    """
+    Cuts a whole recording into consecutive chunks of at most max_chunk_s: each cut is placed in the quietest frame
+    (level averaged over smoothing_frames) of the second half of the remaining window, so it falls into a pause
+    whenever there is one
+    returns the (start, end) sample ranges of the chunks, which cover the audio
+    """
+    max_len = int(max_chunk_s * sample_rate)
+    if len(audio) <= max_len:
+        return [(0, len(audio))]
+    frame_len = int(sample_rate * frame_ms / 1000)
+    num_frames = len(audio) // frame_len
+    frames = np.asarray(audio[:num_frames * frame_len], dtype=np.float32).reshape(num_frames, frame_len)
+    levels = 10 * np.log10(np.mean(np.square(frames, dtype=np.float64), axis=1) + 1e-10)
+    # recordings shorter than the smoothing window are smoothed over all their frames
+    window = min(smoothing_frames, num_frames)
+    if window:
+        levels = np.convolve(levels, np.ones(window) / window, mode="same")
+    ranges = []
+    start = 0
+    while len(audio) - start > max_len:
+        first = -(-(start + max_len // 2) // frame_len)
+        last = (start + max_len) // frame_len
+        if first < last:
+            cut = (first + int(np.argmin(levels[first:last]))) * frame_len + frame_len // 2
+        else:
+            cut = start + max_len
+        ranges.append((start, cut))
+        start = cut
+    ranges.append((start, len(audio)))
+    return ranges
@@ -0,0 +1,398 @@
+import asyncio
+import contextvars
+import importlib
+import io
+import itertools
+import multiprocessing
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from timeit import default_timer as timer
+from typing import Any, Callable
+import numpy as np
+from backend.executor import QueueFullError
+from backend.metrics import collect_metric_events, replay_metric_events
+from backend.tracing import start_trace, annotate
+
+# arrays and byte strings (also inside lists and tuples) from this size on go through shared memory instead of being copied through the pipe
+_shared_memory_min_bytes = 64 * 1024
+
+class WorkerUnavailableError(RuntimeError):
+    pass
+
+class ModelRef:
+    """
+    Placeholder argument of WorkerProcess.run, replaced in the worker by the object its loader returned under name
+    """
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return f"ModelRef({self.name!r})"
+
+def call_method(obj, name: str, *args):
+    """
+    obj.name(*args), so that methods of objects living in a worker (ModelRef) can be run there
+    """
+    return getattr(obj, name)(*args)
+
+def call_function(module_name: str, name: str, *args):
+    """
+    module_name.name(*args) with the module imported where the call runs, so that the process handing calls to a worker
+    does not have to import the module (a function pickles as a reference to its module, which the unpickler imports)
+    """
+    return getattr(importlib.import_module(module_name), name)(*args)
+
+class _SharedBuffer:
+    """
+    A large ndarray, bytes or BytesIO moved through a shared memory block; the receiving process unlinks it,
+    or the sender discards it if the message is never received (rejected, or its receiver died)
+    """
+    def __init__(self, value: np.ndarray | bytes | io.BytesIO):
+        if isinstance(value, np.ndarray):
+            self.kind, self.shape, self.dtype = "ndarray", value.shape, value.dtype.str
+            raw = np.ascontiguousarray(value).reshape(-1).view(np.uint8)
+        else:
+            self.kind = "bytesio" if isinstance(value, io.BytesIO) else "bytes"
+            raw = np.frombuffer(value.getvalue() if isinstance(value, io.BytesIO) else value, dtype=np.uint8)
+        self.size = raw.nbytes
+        block = shared_memory.SharedMemory(create=True, size=max(self.size, 1))
+        # the receiver owns the block from now on, so this process' resource tracker must not unlink it at exit
+        resource_tracker.unregister(block._name, "shared_memory")
+        view = np.ndarray(self.size, np.uint8, block.buf)
+        view[:] = raw
+        del view
+        self.name = block.name
+        block.close()
+
+    def load(self):
+        block = shared_memory.SharedMemory(name=self.name)
+        try:
+            data = bytearray(block.buf[:self.size])
+        finally:
+            block.close()
+            block.unlink()
+        if self.kind == "ndarray":
+            return np.frombuffer(data, dtype=self.dtype).reshape(self.shape)
+        return io.BytesIO(data) if self.kind == "bytesio" else bytes(data)
+
+    def discard(self):
+        try:
+            block = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            # already loaded
+            return
+        block.close()
+        block.unlink()
+
+def _pack(value):
+    if type(value) in (list, tuple):
+        return type(value)(_pack(item) for item in value)
+    if isinstance(value, np.ndarray) and value.dtype != object and value.nbytes >= _shared_memory_min_bytes:
+        return _SharedBuffer(value)
+    if isinstance(value, (bytes, bytearray)) and len(value) >= _shared_memory_min_bytes:
+        return _SharedBuffer(bytes(value))
+    if isinstance(value, io.BytesIO) and value.getbuffer().nbytes >= _shared_memory_min_bytes:
+        return _SharedBuffer(value)
+    return value
+
+def _unpack(value):
+    if type(value) in (list, tuple):
+        return type(value)(_unpack(item) for item in value)
+    return value.load() if isinstance(value, _SharedBuffer) else value
+
+def _discard(value):
+    """
+    Unlinks the shared memory blocks of a packed value that will not (or may not) be unpacked
+    """
+    if type(value) in (list, tuple):
+        for item in value:
+            _discard(item)
+    elif isinstance(value, _SharedBuffer):
+        value.discard()
+
+def _picklable_exception(e: Exception) -> Exception:
+    try:
+        pickle.dumps(e)
+        return e
+    except Exception:
+        return RuntimeError(f"{type(e).__name__}: {e}")
+
+def _worker_main(name: str, loader: Callable[[], dict], max_workers: int, conn, warmup: tuple | None = None):
+    """
+    Entry point of a worker process: loads the models, runs warmup (func, args, rounds) if given, then runs the calls
+    received on conn on max_workers threads.
+    Messages are (kind, call_id, payload) tuples; results carry the metric events and trace attributes of the call
+    """
+    try:
+        objects = loader()
+    except Exception as e:
+        conn.send(("load_error", None, f"{type(e).__name__}: {e}"))
+        return
+    if warmup is not None:
+        func, args, rounds = warmup
+        try:
+            for _ in range(rounds):
+                func(*[objects[arg.name] if isinstance(arg, ModelRef) else arg for arg in args])
+        except Exception as e:
+            # a cold worker still serves requests
+            print(f"{name} worker failed to warm up: {type(e).__name__}: {e}")
+    conn.send(("ready", None, None))
+    send_lock = threading.Lock()
+    cancelled = set()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def resolve(arg):
+        return objects[arg.name] if isinstance(arg, ModelRef) else _unpack(arg)
+
+    def execute(call_id: int, kind: str, func: Callable, args: tuple):
+        trace = start_trace()
+        events = []
+        try:
+            with collect_metric_events(events):
+                result = func(*[resolve(arg) for arg in args])
+                if kind == "iter":
+                    for item in result:
+                        if call_id in cancelled:
+                            break
+                        send(("item", call_id, (_pack(item), events.copy(), dict(trace.attributes))))
+                        events.clear()
+                    result = None
+            send(("end" if kind == "iter" else "result", call_id, (_pack(result), events, trace.attributes)))
+        except Exception as e:
+            # arguments after the one that failed to load (if any) were never unpacked
+            _discard(args)
+            send(("error", call_id, _picklable_exception(e)))
+        finally:
+            cancelled.discard(call_id)
+
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+    queued = {}
+    while True:
+        try:
+            kind, call_id, payload = conn.recv()
+        except EOFError:
+            break
+        if kind == "stop":
+            break
+        if kind == "cancel":
+            cancelled.add(call_id)
+            continue
+        func, args = payload
+        future = pool.submit(contextvars.copy_context().run, execute, call_id, kind, func, args)
+        queued[future] = args
+        future.add_done_callback(lambda future: queued.pop(future, None))
+    pool.shutdown(wait=False, cancel_futures=True)
+    # calls that never started never unpacked their arguments
+    for future, args in list(queued.items()):
+        if future.cancelled():
+            _discard(args)
+
+class WorkerProcess:
+    """
+    Long-lived process running one model family, with the run() / iterate() interface of ModelExecutor.
+    loader() runs in the process and returns {name: object}; ModelRef(name) arguments are replaced by these objects,
+    so func and the other arguments must be picklable (module-level functions, plain data).
+    Large arrays and byte strings travel through shared memory, everything else is pickled through a pipe.
+    Up to max_workers calls run at once in the process; max_queue_size bounds the calls waiting beyond them.
+    A worker that dies fails its pending calls with WorkerUnavailableError and is started again; with warmup set to
+    (func, args, rounds), the new process runs func(*args) rounds times before it takes calls (the first process is
+    warmed up by the caller, through run()).
+    """
+    def __init__(self, name: str, loader: Callable[[], dict], max_workers: int = 1, max_queue_size: int | None = None):
+        self.name = name
+        self.loader = loader
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._call_ids = itertools.count()
+        self._pending = {}
+        self._completed = 0
+        self._restarts = 0
+        self._load_error = None
+        self._stopping = False
+        self.warmup = None
+        self._start_process()
+
+    def _start_process(self):
+        conn, child_conn = self._context.Pipe()
+        # not a daemon: vLLM and torch start processes of their own
+        process = self._context.Process(target=_worker_main, args=(self.name, self.loader, self.max_workers, child_conn,
+                                                                        self.warmup if self._restarts else None),
+                                        name=f"{self.name}-worker")
+        process.start()
+        child_conn.close()
+        self._started_at = timer()
+        self._process, self._conn = process, conn
+        threading.Thread(target=self._read_loop, args=(process, conn), name=f"{self.name}-reader", daemon=True).start()
+
+    def wait_ready(self, timeout: float | None = None):
+        """
+        Blocks until the models are loaded; raises RuntimeError if the loader failed
+        """
+        if not self._ready.wait(timeout):
+            raise WorkerUnavailableError(f"{self.name} worker did not start within {timeout}s")
+        if self._load_error is not None:
+            raise RuntimeError(f"{self.name} worker failed to load: {self._load_error}")
+
+    def _read_loop(self, process, conn):
+        try:
+            while True:
+                kind, call_id, payload = conn.recv()
+                if kind in ("ready", "load_error"):
+                    if kind == "load_error":
+                        self._load_error = payload
+                    self._ready.set()
+                    continue
+                if kind != "error":
+                    value, events, attributes = payload
+                    payload = (_unpack(value), events, attributes)
+                with self._lock:
+                    entry = self._pending.get(call_id) if kind == "item" else self._pending.pop(call_id, None)
+                    if kind != "item":
+                        self._completed += 1
+                if entry is not None and entry[0] is not None:
+                    loop, deliver, _ = entry
+                    loop.call_soon_threadsafe(deliver, kind, payload)
+        except (EOFError, OSError):
+            pass
+        self._on_exit(process)
+
+    def _on_exit(self, process):
+        self._ready.clear()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for loop, deliver, message_args in pending.values():
+            # the worker may have died before unpacking the arguments
+            _discard(message_args)
+            if loop is not None:
+                loop.call_soon_threadsafe(deliver, "error", WorkerUnavailableError(f"{self.name} worker exited"))
+        process.join(timeout=10)
+        if self._stopping or self._load_error is not None:
+            return
+        # a worker that keeps dying right after loading is not restarted in a tight loop
+        delay = min(2 ** self._restarts, 60) if timer() - self._started_at < 60 else 1
+        print(f"{self.name} worker (pid {process.pid}) exited with code {process.exitcode}, restarting it in {delay}s")
+        time.sleep(delay)
+        if self._stopping:
+            return
+        self._restarts += 1
+        self._start_process()
+
+    def _submit(self, kind: str, func: Callable, args: tuple, loop, deliver) -> int:
+        if not self._ready.is_set() or self._load_error is not None:
+            raise WorkerUnavailableError(f"{self.name} worker is not available")
+        # the slot is taken before packing, so a rejected call never creates shared memory blocks
+        with self._lock:
+            if self.max_queue_size is not None and len(self._pending) >= self.max_workers + self.max_queue_size:
+                raise QueueFullError(f"{self.name} queue is full ({len(self._pending) - self.max_workers} waiting)")
+            call_id = next(self._call_ids)
+            self._pending[call_id] = (None, None, ())
+        try:
+            message_args = tuple(_pack(arg) for arg in args)
+        except Exception:
+            with self._lock:
+                self._pending.pop(call_id, None)
+            raise
+        with self._lock:
+            sent = call_id in self._pending
+            if sent:
+                try:
+                    self._conn.send((kind, call_id, (func, message_args)))
+                    self._pending[call_id] = (loop, deliver, message_args)
+                except OSError:
+                    del self._pending[call_id]
+                    sent = False
+        if not sent:
+            # the worker exited while the arguments were packed
+            _discard(message_args)
+            raise WorkerUnavailableError(f"{self.name} worker is not available")
+        return call_id
+
+    def _cancel(self, call_id: int):
+        with self._lock:
+            # the entry stays until the worker answers, so the arguments are discarded if it dies before unpacking them
+            if call_id in self._pending:
+                self._pending[call_id] = (None, None, self._pending[call_id][2])
+            try:
+                self._conn.send(("cancel", call_id, None))
+            except OSError:
+                pass
+
+    async def run(self, func: Callable[..., Any], *args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        def deliver(kind, payload):
+            if future.done():
+                return
+            if kind == "error":
+                future.set_exception(payload)
+            else:
+                future.set_result(payload)
+        call_id = self._submit("call", func, args, loop, deliver)
+        try:
+            value, events, attributes = await future
+        except asyncio.CancelledError:
+            self._cancel(call_id)
+            raise
+        replay_metric_events(events)
+        annotate(**attributes)
+        return value
+
+    async def iterate(self, func: Callable[..., Any], *args):
+        """
+        Admits a stream like run() (raising QueueFullError or WorkerUnavailableError right away) and returns an async
+        iterator over the generator func(*args) run in the worker, which sends each item as soon as it is produced
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        call_id = self._submit("iter", func, args, loop, lambda kind, payload: queue.put_nowait((kind, payload)))
+        return self._items(call_id, queue)
+
+    async def _items(self, call_id: int, queue: asyncio.Queue):
+        finished = False
+        try:
+            while True:
+                kind, payload = await queue.get()
+                if kind == "error":
+                    finished = True
+                    raise payload
+                value, events, attributes = payload
+                replay_metric_events(events)
+                annotate(**attributes)
+                if kind == "end":
+                    finished = True
+                    return
+                yield value
+        finally:
+            if not finished:
+                self._cancel(call_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue_size": self.max_queue_size,
+                "pid": self._process.pid,
+                "alive": self._ready.is_set() and self._process.is_alive(),
+                "in_flight": len(self._pending),
+                "completed": self._completed,
+                "restarts": self._restarts,
+            }
+
+    def shutdown(self):
+        self._stopping = True
+        try:
+            self._conn.send(("stop", None, None))
+        except OSError:
+            pass
+        self._process.join(timeout=10)
+        if self._process.is_alive():
+            self._process.terminate()
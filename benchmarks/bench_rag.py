@@ -0,0 +1,120 @@
+"""
+Microbenchmark of the work backend.rag does around the models, without a GPU:
+the pipelines run against a deterministic fake chat model, a fake embedder and a generated in-memory Chroma store.
+
+python -m benchmarks.bench_rag [--num-docs 5000] [--save-baseline] [--baseline benchmarks/baselines/rag.json]
+"""
+import argparse
+import hashlib
+import os
+import sys
+import uuid
+from typing import Any, get_args
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from backend import rag
+from benchmarks.common import measure, finish
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for QwenModel: answers with answer_chars characters derived from the prompt, instantly
+    """
+    answer_chars: int = 200
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        digest = hashlib.sha1(messages[-1].content.encode("utf-8")).hexdigest()
+        text = ("回答" + digest) * (self.answer_chars // (len(digest) + 2) + 1)
+        text = text[:self.answer_chars]
+        usage = {"input_tokens": len(messages[-1].content), "output_tokens": len(text), "total_tokens": len(messages[-1].content) + len(text)}
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text, usage_metadata=usage))])
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic unit vectors seeded by the text's hash
+    """
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _embed(self, text: str) -> list[float]:
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+def build_vectorstore(num_docs: int, doc_chars: int, dim: int, seed: int = 0) -> Chroma:
+    """
+    In-memory store whose docs carry both a "url" and an "original_doc", so every strategy can use it
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = list("上海交通大学科技创新行动计划申报要求项目经费学生课程研究生招生就业图书馆实验室讲座通知")
+    vectorstore = Chroma(collection_name=f"bench_{uuid.uuid4().hex}", embedding_function=FakeEmbeddings(dim))
+    batch_size = 1000
+    for start in range(0, num_docs, batch_size):
+        texts, metadatas = [], []
+        for i in range(start, min(start + batch_size, num_docs)):
+            texts.append(f"问题{i}：" + "".join(rng.choice(vocabulary, 40)) + "？")
+            metadatas.append({"url": f"https://www.sjtu.edu.cn/bench/{i}.html", "original_doc": "".join(rng.choice(vocabulary, doc_chars))})
+        vectorstore.add_texts(texts, metadatas)
+    return vectorstore
+
+def _conversation(turns: int) -> list[BaseMessage]:
+    messages = []
+    for i in range(turns - 1):
+        messages.append(HumanMessage(content=f"第{i}个问题是什么？"))
+        messages.append(AIMessage(content="这是之前的回答。" * 20, response_metadata={"links": ["https://www.sjtu.edu.cn/"]}))
+    messages.append(HumanMessage(content="科技创新行动计划的申报要求是什么？"))
+    return messages
+
+def run(num_docs: int = 5000, doc_chars: int = 500, dim: int = 384, history_turns: int = 1, repeat: int = 50) -> dict:
+    chat_model = FakeChatModel()
+    vectorstore = build_vectorstore(num_docs, doc_chars, dim)
+    messages = _conversation(history_turns)
+    payload = rag.messages_to_json(messages)
+    docs, contexts = rag._retrieve_hypothetical_question(messages, chat_model, vectorstore)
+    answer = AIMessage(content="回答" * 200, response_metadata={"links": rag._retrieve_links_from_docs(docs)})
+    stages = {
+        "json_to_messages": measure(lambda: rag.json_to_messages(payload), repeat),
+        "messages_to_json": measure(lambda: rag.messages_to_json([answer]), repeat),
+        "context_join": measure(lambda: "\n\n".join(contexts), repeat),
+        "prompt_build": measure(lambda: rag._enhance_latest_message(list(messages), "\n\n".join(contexts)), repeat),
+        "links_from_docs": measure(lambda: rag._retrieve_links_from_docs(docs), repeat),
+        "fake_chat_model": measure(lambda: chat_model.invoke(messages), repeat),
+        "fake_embedding": measure(lambda: vectorstore.embeddings.embed_query(messages[-1].content), repeat),
+    }
+    for strategy in get_args(rag.RAGStrategy):
+        retrieve = rag._strategy_to_retrieve_func[strategy]
+        stages[f"retrieve/{strategy}"] = measure(lambda: retrieve(messages, chat_model, vectorstore), repeat)
+        stages[f"inference/{strategy}"] = measure(lambda: rag.inference(list(messages), chat_model, vectorstore, strategy), repeat)
+    return {
+        "config": {"num_docs": num_docs, "doc_chars": doc_chars, "dim": dim, "history_turns": history_turns, "repeat": repeat},
+        "stages": stages,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the RAG pipeline overhead with fake models")
+    parser.add_argument("--num-docs", type=int, default=5000)
+    parser.add_argument("--doc-chars", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--history-turns", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--baseline", type=str, default=os.path.join(os.path.dirname(__file__), "baselines", "rag.json"))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown of a stage's median reported as a regression")
+    args = parser.parse_args()
+    results = run(args.num_docs, args.doc_chars, args.dim, args.history_turns, args.repeat)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+    sys.exit(finish(results, args.baseline, args.save_baseline, args.tolerance))
@@ -0,0 +1,55 @@
+"""
+Microbenchmark of resampling browser audio to the ASR model's rate and TTS audio to the requested rate:
+the FFT resampling backend.asr used before (scipy.signal.resample in float64), scipy's resample_poly designing
+its filter on every call, and backend.audio.resample_audio / StreamingResampler with the cached filter.
+
+python -m benchmarks.bench_resample [--seconds 1,5,30] [--save-baseline] [--baseline benchmarks/baselines/resample.json]
+"""
+import argparse
+import os
+import sys
+import numpy as np
+from scipy.signal import resample, resample_poly
+from backend.audio import resample_audio, StreamingResampler
+from benchmarks.common import measure, finish
+
+# (source rate, target rate): browser capture to ASR, TTS output to a requested rate
+rate_pairs = ((48000, 16000), (44100, 16000), (24000, 44100))
+
+def _stream(audio: np.ndarray, src_rate: int, dst_rate: int, chunk_len: int) -> np.ndarray:
+    resampler = StreamingResampler(src_rate, dst_rate)
+    chunks = [resampler.process(audio[i:i+chunk_len]) for i in range(0, len(audio), chunk_len)]
+    chunks.append(resampler.flush())
+    return np.concatenate(chunks)
+
+def run(seconds: list[float], chunk_ms: float = 20, repeat: int = 20) -> dict:
+    rng = np.random.default_rng(0)
+    stages = {}
+    for src_rate, dst_rate in rate_pairs:
+        for duration in seconds:
+            # one sample more than the duration, so the FFT path gets the prime-ish lengths real clips have
+            audio = rng.uniform(-0.5, 0.5, int(src_rate * duration) + 1).astype(np.float32)
+            name = f"{src_rate}->{dst_rate}/{duration:g}s"
+            stages[f"fft_float64/{name}"] = measure(lambda: resample(audio.astype(np.float64), int(len(audio) * dst_rate / src_rate)), repeat)
+            stages[f"resample_poly/{name}"] = measure(lambda: resample_poly(audio, dst_rate, src_rate), repeat)
+            stages[f"polyphase_cached/{name}"] = measure(lambda: resample_audio(audio, src_rate, dst_rate), repeat)
+            chunk_len = int(src_rate * chunk_ms / 1000)
+            stages[f"streaming_{chunk_ms:g}ms/{name}"] = measure(lambda: _stream(audio, src_rate, dst_rate, chunk_len), repeat)
+    return {
+        "config": {"seconds": seconds, "chunk_ms": chunk_ms, "repeat": repeat},
+        "stages": stages,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the resampling paths of ASR input and TTS output")
+    parser.add_argument("--seconds", type=str, default="1,5,30", help="comma-separated clip durations")
+    parser.add_argument("--chunk-ms", type=float, default=20, help="chunk length of the streaming resampler")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--baseline", type=str, default=os.path.join(os.path.dirname(__file__), "baselines", "resample.json"))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown of a stage's median reported as a regression")
+    args = parser.parse_args()
+    results = run([float(duration) for duration in args.seconds.split(",")], args.chunk_ms, args.repeat)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+    sys.exit(finish(results, args.baseline, args.save_baseline, args.tolerance))
@@ -0,0 +1,80 @@
+import json
+import platform
+import tracemalloc
+from timeit import default_timer as timer
+from typing import Callable
+import numpy as np
+
+def measure(func: Callable[[], object], repeat: int = 50, warmup: int = 2) -> dict:
+    """
+    Times repeat calls of func after warmup calls, then measures the peak memory allocated by one more call
+    (separately, as tracemalloc slows the calls down)
+    returns {"median_us", "p95_us", "mean_us", "peak_kib"}
+    """
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        start = timer()
+        func()
+        times.append(timer() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    times = np.array(times) * 1e6
+    return {
+        "median_us": float(np.median(times)),
+        "p95_us": float(np.percentile(times, 95)),
+        "mean_us": float(times.mean()),
+        "peak_kib": peak / 1024,
+    }
+
+def compare_to_baseline(stages: dict, baseline_stages: dict, tolerance: float) -> list[str]:
+    """
+    returns a description of every stage whose median is more than tolerance (relative) above the baseline
+    """
+    regressions = []
+    for name, result in stages.items():
+        if name not in baseline_stages:
+            continue
+        base = baseline_stages[name]["median_us"]
+        if result["median_us"] > base * (1 + tolerance):
+            regressions.append(f"{name}: {result['median_us']:.1f}us vs baseline {base:.1f}us (+{result['median_us'] / base - 1:.0%})")
+    return regressions
+
+def print_stages(stages: dict, baseline_stages: dict | None = None):
+    print(f"{'stage':<44}{'median us':>12}{'p95 us':>12}{'peak KiB':>12}{'vs base':>10}")
+    for name, result in stages.items():
+        change = ""
+        if baseline_stages and name in baseline_stages:
+            change = f"{result['median_us'] / baseline_stages[name]['median_us'] - 1:+.0%}"
+        print(f"{name:<44}{result['median_us']:>12.1f}{result['p95_us']:>12.1f}{result['peak_kib']:>12.1f}{change:>10}")
+
+def finish(results: dict, baseline_path: str | None, save_baseline: bool, tolerance: float) -> int:
+    """
+    Prints the results, then saves them as the baseline or compares them to it
+    returns the exit code: 1 if a stage regressed beyond tolerance
+    """
+    results["machine"] = {"python": platform.python_version(), "processor": platform.processor() or platform.machine()}
+    baseline = None
+    if baseline_path and not save_baseline:
+        try:
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"No baseline at {baseline_path}, run with --save-baseline first")
+    print_stages(results["stages"], baseline["stages"] if baseline else None)
+    if save_baseline and baseline_path:
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+        return 0
+    if baseline is None:
+        return 0
+    if baseline.get("config") != results.get("config"):
+        print("Warning: the baseline was recorded with a different configuration")
+    regressions = compare_to_baseline(results["stages"], baseline["stages"], tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
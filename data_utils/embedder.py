@@ -9,6 +9,7 @@ from langchain_core.embeddings import Embeddings
 from bs4 import BeautifulSoup
 from typing import Literal
 from utils.models import QwenModel
+from utils.prompts import load_prompt
 import os
 from tqdm.auto import tqdm
 
@@ -95,6 +96,18 @@ def _batch_add_documents(vectorstore: Chroma, docs: list[Document], result_path:
         progress.update(batch_size)
 
 
+def _generate_hypothetical_questions(docs: list[Document], llm: QwenModel, max_batch_size: int | None = None) -> list[str]:
+    """
+    Generates one hypothetical question per doc with batched generation
+    """
+    from langchain_core.messages import HumanMessage
+    template = load_prompt("hypothetical_question", "1")
+    messages_list = [[HumanMessage(content=template.format(context=doc.page_content))] for doc in docs]
+    progress = tqdm(total=len(docs), desc="Generating hypothetical questions")
+    answers = llm.batch_generate(messages_list, max_batch_size, lambda done, total: progress.update(done - progress.n))
+    progress.close()
+    return [answer.content for answer in answers]
+
 def _embedding_strategy_raw(docs: list[Document], embeddings_model: Embeddings, result_path: str, batch_size: int=16):
     from langchain_text_splitters import RecursiveCharacterTextSplitter
     text_splitter = RecursiveCharacterTextSplitter(
@@ -104,17 +117,8 @@ def _embedding_strategy_raw(docs: list[Document], embeddings_model: Embeddings,
     vectorstore = Chroma(persist_directory=result_path, embedding_function=embeddings_model)
     _batch_add_documents(vectorstore, all_splits, result_path, batch_size)
     
-def _embedding_strategy_hypothetical_question(docs: list[Document], embeddings_model: Embeddings, result_path: str, batch_size: int=16,chat_model_name: str="Qwen/Qwen2.5-1.5B-Instruct"):
-    def generate_hypothetical_question(doc: Document, llm):
-        from langchain_core.prompts import PromptTemplate
-        template = PromptTemplate(
-            input_variables=["context"],
-            template="基于以下内容生成一个相关但未明确提及的假设性问题：\n\n{context}"
-        )
-        prompt = template.format(context=doc.page_content)
-        question = llm.invoke(prompt).content
-        return question
-
+def _embedding_strategy_hypothetical_question(docs: list[Document], embeddings_model: Embeddings, result_path: str, batch_size: int=16,chat_model_name: str="Qwen/Qwen2.5-1.5B-Instruct",
+        generation_batch_size: int=256):
     def clean_html_content(html: str) -> str:
         soup = BeautifulSoup(html, "html.parser")
         return soup.get_text(separator=" ", strip=True)
@@ -131,8 +135,7 @@ def _embedding_strategy_hypothetical_question(docs: list[Document], embeddings_m
         )
         all_splits = text_splitter.split_documents(docs)
         hypothetical_questions = []
-        for doc in tqdm(all_splits, desc="Generating hypothetical questions"):
-            hypothetical_question = generate_hypothetical_question(doc, chat_model)
+        for doc, hypothetical_question in zip(all_splits, _generate_hypothetical_questions(all_splits, chat_model, generation_batch_size)):
             hypothetical_question_doc = Document(page_content=hypothetical_question, metadata={"original_doc": doc.page_content, **doc.metadata})
             hypothetical_questions.append(hypothetical_question_doc)
         _cache_documents(hypothetical_questions, result_path)
@@ -144,17 +147,8 @@ def _embedding_strategy_hypothetical_question(docs: list[Document], embeddings_m
     vectorstore = Chroma(persist_directory=result_path, embedding_function=embeddings_model)
     _batch_add_documents(vectorstore, hypothetical_questions, result_path, batch_size)
 
-def _embedding_strategy_hypothetical_question_with_raw(docs: list[Document], embeddings_model: Embeddings, result_path: str, batch_size: int=16,chat_model_name: str="Qwen/Qwen2.5-1.5B-Instruct"):
-    def generate_hypothetical_question(doc: Document, llm):
-        from langchain_core.prompts import PromptTemplate
-        template = PromptTemplate(
-            input_variables=["context"],
-            template="基于以下内容生成一个相关但未明确提及的假设性问题：\n\n{context}"
-        )
-        prompt = template.format(context=doc.page_content)
-        question = llm.invoke(prompt).content
-        return question
-
+def _embedding_strategy_hypothetical_question_with_raw(docs: list[Document], embeddings_model: Embeddings, result_path: str, batch_size: int=16,chat_model_name: str="Qwen/Qwen2.5-1.5B-Instruct",
+        generation_batch_size: int=256):
     def clean_html_content(html: str) -> str:
         soup = BeautifulSoup(html, "html.parser")
         return soup.get_text(separator=" ", strip=True)
@@ -170,13 +164,12 @@ def _embedding_strategy_hypothetical_question_with_raw(docs: list[Document], emb
             chunk_size=500, chunk_overlap=100, add_start_index=True
         )
         all_splits = text_splitter.split_documents(docs)
-        hypothetical_questions_doc = []
-        for doc in tqdm(all_splits, desc="Generating hypothetical questions"):
-            hypothetical_question = generate_hypothetical_question(doc, chat_model)
+        hypothetical_questions = []
+        for doc, hypothetical_question in zip(all_splits, _generate_hypothetical_questions(all_splits, chat_model, generation_batch_size)):
             page_content = "Hypothetical question: " + hypothetical_question + "\n\nContext: " + doc.page_content
             hypothetical_question_doc = Document(page_content=page_content, metadata=doc.metadata)
             hypothetical_questions.append(hypothetical_question_doc)
-        _cache_documents(hypothetical_questions_doc, result_path)
+        _cache_documents(hypothetical_questions, result_path)
         print("Cached hypothetical question docs")
         print("IMPORTANT: If you meet GPU memory issues, you can start this process again to directly load from cache")
     else:
@@ -186,9 +179,11 @@ def _embedding_strategy_hypothetical_question_with_raw(docs: list[Document], emb
     _batch_add_documents(vectorstore, hypothetical_questions, result_path, batch_size)
 
 EmbeddingStrategy = Literal["hypothetical_question", "raw", "hypothetical_question_with_raw"]
-def save_vectorstore_from_huggingface(content_json_path: str, result_path: str, embedding_model_name: str, embedding_strategy: EmbeddingStrategy="hypothetical_question", batch_size: int=16):
+def save_vectorstore_from_huggingface(content_json_path: str, result_path: str, embedding_model_name: str, embedding_strategy: EmbeddingStrategy="hypothetical_question", batch_size: int=16,
+                                      generation_batch_size: int=256):
     """
     Create vectorstore from content_json_path (created from extract_content) with embedding_model_name; save the results result_path
+    Hypothetical questions are generated generation_batch_size chunks at a time, which bounds memory and reports progress per batch
     """
     if not os.path.exists(result_path):
         os.makedirs(result_path)
@@ -208,4 +203,7 @@ def save_vectorstore_from_huggingface(content_json_path: str, result_path: str,
         embedding_func = _embedding_strategy_hypothetical_question_with_raw
     else:
         raise ValueError(f"Unknown embedding strategy: {embedding_strategy}")
-    embedding_func(docs, embeddings_model, result_path, batch_size)
\ No newline at end of file
+    if embedding_strategy == "raw":
+        embedding_func(docs, embeddings_model, result_path, batch_size)
+    else:
+        embedding_func(docs, embeddings_model, result_path, batch_size, generation_batch_size=generation_batch_size)
\ No newline at end of file
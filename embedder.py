@@ -7,9 +7,11 @@ if __name__ == "__main__":
     parser.add_argument("--output-dir", type=str, required=True)
     parser.add_argument("--strategy", type=str, default="hypothetical_question")
     parser.add_argument("--embedding-model", type=str, default="Alibaba-NLP/gte-Qwen2-1.5B-instruct")
+    parser.add_argument("--generation-batch-size", type=int, default=256, help="chunks per hypothetical question generation call")
     args = parser.parse_args()
 
     print(f"Embedding strategy: {args.strategy}")
     print(f"Embedding strategies available: {EmbeddingStrategy.__args__}")
-    save_vectorstore_from_huggingface(args.content_json_path, args.output_dir, args.embedding_model, args.strategy)
+    save_vectorstore_from_huggingface(args.content_json_path, args.output_dir, args.embedding_model, args.strategy,
+                                      generation_batch_size=args.generation_batch_size)
     print("Vectorstore saved to", args.output_dir)
\ No newline at end of file
@@ -0,0 +1,209 @@
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+import numpy as np
+import requests
+import soundfile as sf
+from backend.traffic import encode_request, decode_request, load_corpus
+
+def _questions_corpus(path: str, endpoints: list[str]) -> list[dict]:
+    """
+    Turns one question per line into requests to endpoints (the question is also used as TTS text)
+    """
+    with open(path, encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+    corpus = []
+    for question in questions:
+        for endpoint in endpoints:
+            if endpoint in ("/rag", "/rag/stream"):
+                body = {"messages": [{"type": "human", "content": question, "response_metadata": {}}]}
+            elif endpoint == "/tts":
+                body = {"text": question, "format": "mp3", "stream": True}
+            else:
+                continue
+            corpus.append(encode_request(endpoint, {"content-type": "application/json"}, json.dumps(body, ensure_ascii=False).encode("utf-8"), timestamp=0))
+    return corpus
+
+def _audio_corpus(path: str) -> list[dict]:
+    audio, sample_rate = sf.read(path, dtype="int16")
+    if audio.ndim > 1:
+        audio = audio[:, 0]
+    headers = {"content-type": "audio/pcm", "x-sample-rate": str(sample_rate), "x-pcm-format": "int16"}
+    return [encode_request("/asr", headers, audio.astype("<i2").tobytes(), timestamp=0)]
+
+def _parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        endpoint, weight = item.split("=")
+        weights["/" + endpoint.strip().lstrip("/")] = float(weight)
+    return weights
+
+class _RequestPicker:
+    """
+    Replays the corpus in order, or, with a mix, picks an endpoint by weight and then a random request to it
+    """
+    def __init__(self, corpus: list[dict], mix: dict[str, float] | None, seed: int):
+        self._corpus = corpus
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._index = 0
+        self._by_endpoint = {}
+        for record in corpus:
+            self._by_endpoint.setdefault(record["endpoint"], []).append(record)
+        self._mix = None
+        if mix:
+            missing = [endpoint for endpoint in mix if endpoint not in self._by_endpoint]
+            if missing:
+                raise ValueError(f"No requests to {', '.join(missing)} in the corpus")
+            self._mix = (list(mix), list(mix.values()))
+
+    def next(self) -> dict:
+        with self._lock:
+            if self._mix is None:
+                record = self._corpus[self._index % len(self._corpus)]
+                self._index += 1
+                return record
+            endpoint = self._random.choices(*self._mix)[0]
+            return self._random.choice(self._by_endpoint[endpoint])
+
+# a streamed answer that fails after the 200 status (see /rag/stream) ends with this event
+_sse_error_marker = b"event: error\n"
+
+def _send(session: requests.Session, base_url: str, record: dict, timeout: float, scheduled: float | None = None) -> dict:
+    """
+    Latency and time to first byte count from scheduled (the request's arrival time in open loop mode) when given,
+    so that time spent waiting for a free client thread is included instead of hidden (coordinated omission)
+    """
+    endpoint, headers, body = decode_request(record)
+    start = timer() if scheduled is None else scheduled
+    result = {"endpoint": record["endpoint"], "ok": False, "ttfb": None, "send_delay": timer() - start}
+    try:
+        with session.post(base_url + endpoint, data=body, headers=headers, stream=True, timeout=timeout) as response:
+            event_stream = response.headers.get("content-type", "").startswith("text/event-stream")
+            stream_error = False
+            tail = b""
+            for chunk in response.iter_content(chunk_size=None):
+                if result["ttfb"] is None and chunk:
+                    result["ttfb"] = timer() - start
+                if event_stream and not stream_error:
+                    # the marker may be split between chunks
+                    stream_error = _sse_error_marker in tail + chunk
+                    tail = (tail + chunk)[-len(_sse_error_marker):]
+            result["status"] = response.status_code
+            result["ok"] = response.status_code < 400 and not stream_error
+            if stream_error:
+                result["error"] = "stream error event"
+    except requests.RequestException as e:
+        result["error"] = type(e).__name__
+    result["latency"] = timer() - start
+    return result
+
+def _summary(results: list[dict], elapsed: float) -> dict:
+    def percentiles(values):
+        if not values:
+            return None
+        values = np.array(values) * 1000
+        return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+                "p99": float(np.percentile(values, 99)), "mean": float(values.mean())}
+    ok = [result for result in results if result["ok"]]
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "throughput_rps": len(ok) / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": percentiles([result["latency"] for result in ok]),
+        "ttfb_ms": percentiles([result["ttfb"] for result in ok if result["ttfb"] is not None]),
+        "send_delay_ms": percentiles([result["send_delay"] for result in results]),
+    }
+
+def run_load_test(base_url: str, corpus: list[dict], num_requests: int, concurrency: int = 1, rate: float | None = None,
+                  replay_timing: bool = False, speed: float = 1.0, mix: dict[str, float] | None = None,
+                  timeout: float = 300, seed: int = 0) -> dict:
+    """
+    Closed loop (rate None): concurrency clients each send their next request as soon as the previous one is done.
+    Open loop: requests arrive at rate per second (Poisson arrivals), or at the corpus' recorded times divided by speed
+    with replay_timing, whatever the server's latency; their latency counts from the scheduled arrival.
+    returns the summary over all requests and by endpoint
+    """
+    picker = _RequestPicker(corpus, mix, seed)
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max(concurrency, 64)))
+    results = []
+    start = timer()
+    if rate is None and not replay_timing:
+        lock, counter = threading.Lock(), [0]
+        def client():
+            while True:
+                with lock:
+                    if counter[0] >= num_requests:
+                        return
+                    counter[0] += 1
+                results.append(_send(session, base_url, picker.next(), timeout))
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        arrival_random = random.Random(seed + 1)
+        records = [picker.next() for _ in range(num_requests)]
+        if replay_timing:
+            records.sort(key=lambda record: record["time"])
+            offsets = [(record["time"] - records[0]["time"]) / speed for record in records]
+        else:
+            offsets = np.cumsum([arrival_random.expovariate(rate) for _ in records]).tolist()
+        with ThreadPoolExecutor(max_workers=max(concurrency, 256)) as pool:
+            futures = []
+            for offset, record in zip(offsets, records):
+                delay = start + offset - timer()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(pool.submit(_send, session, base_url, record, timeout, start + offset))
+            results = [future.result() for future in futures]
+    elapsed = timer() - start
+    summary = _summary(results, elapsed)
+    summary["duration_s"] = elapsed
+    summary["mode"] = "closed" if rate is None and not replay_timing else "open"
+    summary["by_endpoint"] = {
+        endpoint: _summary([result for result in results if result["endpoint"] == endpoint], elapsed)
+        for endpoint in sorted({result["endpoint"] for result in results})
+    }
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays a request corpus against the server and reports latency percentiles as JSON")
+    parser.add_argument("--url", type=str, default="http://localhost:9834")
+    parser.add_argument("--corpus", type=str, action="append", default=[], help="JSONL corpus, e.g. recorded with --traffic-sample-path")
+    parser.add_argument("--questions", type=str, default=None, help="text file with one question per line, e.g. rag_eval/sample_questions.txt")
+    parser.add_argument("--question-endpoints", type=str, default="/rag", help="comma-separated endpoints the questions are sent to (/rag, /rag/stream, /tts)")
+    parser.add_argument("--asr-audio", type=str, default=None, help="audio file sent to /asr as int16 PCM")
+    parser.add_argument("--num-requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4, help="clients in closed loop mode")
+    parser.add_argument("--rate", type=float, default=None, help="open loop: mean arrivals per second")
+    parser.add_argument("--replay-timing", action="store_true", help="open loop at the corpus' recorded arrival times")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed-up of --replay-timing")
+    parser.add_argument("--mix", type=str, default=None, help="endpoint weights, e.g. rag=0.6,tts=0.3,asr=0.1")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="also write the JSON report here")
+    args = parser.parse_args()
+
+    corpus = []
+    for path in args.corpus:
+        corpus.extend(load_corpus(path))
+    if args.questions:
+        corpus.extend(_questions_corpus(args.questions, args.question_endpoints.split(",")))
+    if args.asr_audio:
+        corpus.extend(_audio_corpus(args.asr_audio))
+    if not corpus:
+        parser.error("no requests: give --corpus, --questions or --asr-audio")
+    report = run_load_test(args.url.rstrip("/"), corpus, args.num_requests, args.concurrency, args.rate,
+                           args.replay_timing, args.speed, _parse_mix(args.mix) if args.mix else None, args.timeout, args.seed)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -3,6 +3,7 @@ const targetHost = "localhost";
 const port = "9834";
 const apiUrl = targetHost.includes("localhost") ? `http://${targetHost}:${port}` : targetHost;
 const ragEndpoint = `${apiUrl}/rag`;
+const ragStreamEndpoint = `${apiUrl}/rag/stream`;
 const asrEndpoint = `${apiUrl}/asr`;
 const ttsEndpoint = `${apiUrl}/tts`;
-export { ragEndpoint, asrEndpoint, ttsEndpoint };
\ No newline at end of file
+export { ragEndpoint, ragStreamEndpoint, asrEndpoint, ttsEndpoint };
\ No newline at end of file
@@ -6,7 +6,7 @@ from ragas.embeddings import LangchainEmbeddingsWrapper
 from langchain_openai import OpenAIEmbeddings
 from langchain_openai import ChatOpenAI
 import os
-from backend.rag import inference as rag_inference, RAGStrategy
+from backend.rag import inference as rag_inference, batch_inference as rag_batch_inference, RAGStrategy
 from tqdm.auto import tqdm
 from typing import Literal
 from utils.models import QwenModel
@@ -83,7 +83,7 @@ def _get_questions(file_name: str):
     questions = [question.strip() for question in questions]
     return questions
 
-def eval_rag_strategy(strategy: RAGStrategy | Literal["nothing"], vectorstore_path: str = "test_output/sample_embeddings", questions_file: str="sample_questions.txt", evaluation_model: str="Qwen/Qwen2.5-1.5B-Instruct", llm_gpu_memory_utilization: float = 0.6):
+def eval_rag_strategy(strategy: RAGStrategy | Literal["nothing"], vectorstore_path: str = "test_output/sample_embeddings", questions_file: str="sample_questions.txt", evaluation_model: str="Qwen/Qwen2.5-1.5B-Instruct", llm_gpu_memory_utilization: float = 0.6, max_batch_size: int | None = None):
     def strategy_nothing(question: str):
         return "", [""]
     rag_results = []
@@ -92,13 +92,17 @@ def eval_rag_strategy(strategy: RAGStrategy | Literal["nothing"], vectorstore_pa
         chat_model = QwenModel(model=evaluation_model, gpu_memory_utilization=llm_gpu_memory_utilization)
         vectorstore = get_hf_vectorstore(vectorstore_path)
     rag_start_time = timer()
-    for question in tqdm(questions, desc="RAG generation"):
-        if strategy == "nothing":
+    if strategy == "nothing":
+        for question in tqdm(questions, desc="RAG generation"):
             response, retrieved_context = strategy_nothing(question)
-        else:
-            inferenced_message, retrieved_context = rag_inference([HumanMessage(content=question)], chat_model, vectorstore, strategy)
-            response = inferenced_message.content
-        rag_results.append(RAGResult(question=question, retrieved_context=retrieved_context, response=response))
+            rag_results.append(RAGResult(question=question, retrieved_context=retrieved_context, response=response))
+    else:
+        progress = tqdm(total=len(questions), desc="RAG generation")
+        batch_results = rag_batch_inference([[HumanMessage(content=question)] for question in questions], chat_model, vectorstore, strategy,
+                                            max_batch_size=max_batch_size, progress_callback=lambda done, total: progress.update(done - progress.n))
+        progress.close()
+        for question, (inferenced_message, retrieved_context) in zip(questions, batch_results):
+            rag_results.append(RAGResult(question=question, retrieved_context=retrieved_context, response=inferenced_message.content))
     rag_time_elapsed = timer() - rag_start_time
     rag_time_per_question = rag_time_elapsed / len(questions)
     rag_eval_results = _eval_rag_results(rag_results)
@@ -8,6 +8,41 @@ if __name__ == "__main__":
     parser.add_argument("--port", type=int, default=9834)
     parser.add_argument("--llm-gpu-memory-utilization", type=float, default=0.6)
     parser.add_argument("--rag-strategy", type=str, default="hypothetical_question")
+    parser.add_argument("--rag-concurrency", type=int, default=16)
+    parser.add_argument("--tts-concurrency", type=int, default=1)
+    parser.add_argument("--asr-concurrency", type=int, default=2)
+    parser.add_argument("--max-queue-size", type=int, default=None)
+    parser.add_argument("--llm-max-num-seqs", type=int, default=256)
+    parser.add_argument("--tts-cache-mb", type=float, default=256, help="memory for cached TTS segments, 0 disables the cache")
+    parser.add_argument("--tts-cache-dir", type=str, default=None, help="optional on-disk tier for cached TTS segments")
+    parser.add_argument("--tts-cache-disk-mb", type=float, default=2048)
+    parser.add_argument("--tts-cache-prefill", type=str, default="backend/tts_prefill.txt", help="texts to synthesize into the cache at startup")
+    parser.add_argument("--tts-batch-size", type=int, default=4, help="max text segments synthesized together")
+    parser.add_argument("--rag-cache-size", type=int, default=1024, help="max answers in the semantic answer cache, 0 disables it")
+    parser.add_argument("--rag-cache-threshold", type=float, default=0.95, help="min cosine similarity for a cached answer to be reused")
+    parser.add_argument("--rag-cache-ttl", type=float, default=24 * 3600, help="seconds a cached answer stays valid")
+    parser.add_argument("--rag-hypo-cache-mb", type=float, default=64, help="memory for cached hypothetical answers, 0 disables the cache")
+    parser.add_argument("--rag-hypo-cache-dir", type=str, default=None, help="optional on-disk tier for cached hypothetical answers")
+    parser.add_argument("--rag-hypo-cache-disk-mb", type=float, default=512)
+    parser.add_argument("--services", type=str, default="rag,tts,asr", help="comma-separated services to load and serve")
+    parser.add_argument("--warmup-rounds", type=int, default=1, help="synthetic requests per service before /health/ready reports ready")
+    parser.add_argument("--trace-log", type=str, default=None, help="JSONL file receiving one trace per request")
+    parser.add_argument("--traffic-sample-path", type=str, default=None, help="JSONL file receiving sampled requests, for load_test.py")
+    parser.add_argument("--traffic-sample-rate", type=float, default=0.01, help="fraction of requests to sample")
+    parser.add_argument("--rag-speculative-budget", type=float, default=2.0, help="seconds the speculative strategy waits for the hypothetical answer")
+    parser.add_argument("--asr-batch-size", type=int, default=8, help="max concurrent ASR requests decoded in one model call, 1 disables batching")
+    parser.add_argument("--asr-batch-wait-ms", type=float, default=5, help="max time an ASR request waits for others to batch with")
+    parser.add_argument("--asr-max-chunk-seconds", type=float, default=30, help="longer /asr audio is cut at pauses into chunks decoded in parallel, 0 disables chunking")
+    parser.add_argument("--worker-processes", type=str, default="", help="comma-separated services whose models run in a worker process of their own")
     args = parser.parse_args()
 
-    launch_server(args.chat_model, args.vectorstore_source_dir, args.port, args.rag_strategy, args.llm_gpu_memory_utilization)
+    launch_server(args.chat_model, args.vectorstore_source_dir, args.port, args.rag_strategy, args.llm_gpu_memory_utilization,
+                  args.rag_concurrency, args.tts_concurrency, args.asr_concurrency, args.max_queue_size, args.llm_max_num_seqs,
+                  args.tts_cache_mb, args.tts_cache_dir, args.tts_cache_disk_mb, args.tts_cache_prefill,
+                  args.tts_batch_size, args.rag_cache_size, args.rag_cache_threshold, args.rag_cache_ttl,
+                  args.rag_hypo_cache_mb, args.rag_hypo_cache_dir, args.rag_hypo_cache_disk_mb,
+                  args.rag_speculative_budget, args.services.split(","),
+                  args.warmup_rounds, args.trace_log,
+                  args.traffic_sample_path, args.traffic_sample_rate,
+                  [name for name in args.worker_processes.split(",") if name], args.asr_batch_size, args.asr_batch_wait_ms,
+                  args.asr_max_chunk_seconds)
@@ -37,13 +37,14 @@ if __name__ == "__main__":
         print(f"Bad request：{response.status_code}")
 
     url = "http://localhost:9834/asr"
-    audio_data, sample_rate = sf.read("test_output/ref_audio.mp3")
-    data = {"sample_rate": sample_rate, "audio_data": audio_data.tolist()}
+    audio_data, sample_rate = sf.read("test_output/ref_audio.mp3", dtype="int16")
+    if audio_data.ndim > 1:
+        audio_data = audio_data[:, 0]
     start = timeit.default_timer()
-    response = requests.post(url, json=data, stream=True)
+    response = requests.post(url, data=audio_data.astype("<i2").tobytes(), headers={"Content-Type": "audio/pcm", "X-Sample-Rate": str(sample_rate), "X-PCM-Format": "int16"})
     if response.status_code == 200:
         end = timeit.default_timer()
-        print(f"TTS Time elapsed: {end - start}")
+        print(f"ASR Time elapsed: {end - start}")
         print(response.text)
     else:
         print(f"Bad request：{response.status_code}")
\ No newline at end of file
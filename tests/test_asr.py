@@ -0,0 +1,66 @@
+import asyncio
+import numpy as np
+import pytest
+pytest.importorskip("prometheus_client")
+from backend.transcription import StreamingSession
+
+sample_rate = 16000
+
+def speech_with_pauses(num_segments: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    silence = np.zeros(sample_rate, dtype=np.float32)
+    parts = [silence]
+    for _ in range(num_segments):
+        parts += [rng.uniform(-0.5, 0.5, sample_rate).astype(np.float32), silence]
+    return np.concatenate(parts)
+
+def run_session(transcribe, audio: np.ndarray, partial_interval_s: float = 0.2) -> tuple[list[dict], str, StreamingSession]:
+    messages = []
+    async def send(message):
+        messages.append(message)
+    async def main():
+        session = StreamingSession(sample_rate, transcribe, send, partial_interval_s=partial_interval_s)
+        for i in range(0, len(audio), 1600):
+            await session.feed(audio[i:i+1600])
+            await asyncio.sleep(0)
+        return await session.finish(), session
+    text, session = asyncio.run(main())
+    return messages, text, session
+
+def test_failed_segment_is_reported_and_later_segments_still_sent():
+    calls = []
+    async def transcribe(audio, rate):
+        calls.append(len(audio))
+        first = len(calls) == 1
+        await asyncio.sleep(0.001)
+        if first:
+            raise RuntimeError("model failed")
+        return "x"
+    messages, text, session = run_session(transcribe, speech_with_pauses(3), partial_interval_s=100)
+    assert [message["type"] for message in messages] == ["error", "final", "final", "done"]
+    assert messages[0]["index"] == 0 and "model failed" in messages[0]["detail"]
+    assert session.failed_segments == 1
+    assert text == "xx"
+
+def test_failed_partial_is_dropped():
+    async def transcribe(audio, rate):
+        await asyncio.sleep(0.001)
+        if len(audio) < sample_rate:
+            raise RuntimeError("model failed")
+        return "x"
+    messages, text, session = run_session(transcribe, speech_with_pauses(2))
+    assert [message["type"] for message in messages if message["type"] != "partial"] == ["final", "final", "done"]
+    assert text == "xx"
+    assert session.failed_segments == 0
+
+def test_finish_cancels_pending_partial():
+    async def transcribe(audio, rate):
+        if len(audio) < sample_rate:
+            await asyncio.sleep(10)
+        return "x"
+    rng = np.random.default_rng(0)
+    # speech until the end, so a partial hypothesis is still running when finish() is called
+    audio = np.concatenate([np.zeros(sample_rate, dtype=np.float32), rng.uniform(-0.5, 0.5, sample_rate).astype(np.float32)])
+    messages, text, session = run_session(transcribe, audio)
+    assert session._partial_task is not None and session._partial_task.done()
+    assert messages[-1] == {"type": "done", "text": "x"}
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from scipy.signal import resample_poly
+from backend.audio import resample_audio, StreamingResampler
+
+rate_pairs = [(48000, 16000), (44100, 16000), (24000, 44100), (8000, 24000), (16000, 16000)]
+
+def random_audio(length: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).uniform(-0.5, 0.5, length).astype(np.float32)
+
+def stream(audio: np.ndarray, resampler: StreamingResampler, chunk_lengths) -> np.ndarray:
+    chunks, position = [], 0
+    for chunk_len in chunk_lengths:
+        chunks.append(resampler.process(audio[position:position+chunk_len]))
+        position += chunk_len
+    chunks.append(resampler.flush())
+    return np.concatenate(chunks)
+
+@pytest.mark.parametrize("src_rate, dst_rate", rate_pairs)
+@pytest.mark.parametrize("length", [1, 37, 4801, 48000])
+def test_resample_audio_equals_resample_poly(src_rate, dst_rate, length):
+    audio = random_audio(length)
+    result = resample_audio(audio, src_rate, dst_rate)
+    assert result.dtype == np.float32
+    if src_rate == dst_rate:
+        np.testing.assert_array_equal(result, audio)
+        return
+    up, down = dst_rate // np.gcd(src_rate, dst_rate), src_rate // np.gcd(src_rate, dst_rate)
+    np.testing.assert_allclose(result, resample_poly(audio.astype(np.float64), up, down), atol=1e-5)
+
+@pytest.mark.parametrize("src_rate, dst_rate", rate_pairs)
+def test_streaming_resampler_equals_one_shot(src_rate, dst_rate):
+    rng = np.random.default_rng(1)
+    audio = random_audio(src_rate * 2 + 123)
+    chunk_lengths = []
+    while sum(chunk_lengths) < len(audio):
+        chunk_lengths.append(int(rng.integers(0, src_rate // 10)))
+    streamed = stream(audio, StreamingResampler(src_rate, dst_rate), chunk_lengths)
+    np.testing.assert_allclose(streamed, resample_audio(audio, src_rate, dst_rate), atol=1e-6)
+
+def test_streaming_resampler_holds_back_less_than_a_few_milliseconds():
+    resampler = StreamingResampler(48000, 16000)
+    output = resampler.process(random_audio(48000))
+    assert 16000 - len(output) < 16000 * 0.005
+    assert len(output) + len(resampler.flush()) == 16000
+
+def test_streaming_resampler_tiny_chunks():
+    audio = random_audio(3000)
+    streamed = stream(audio, StreamingResampler(44100, 16000), [1] * len(audio))
+    np.testing.assert_allclose(streamed, resample_audio(audio, 44100, 16000), atol=1e-6)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from backend import cache
+from backend.cache import LRUCache, SemanticCache
+
+vectors = {
+    "a": [1.0, 0.0, 0.0],
+    "a'": [0.99, 0.1, 0.0],
+    "b": [0.0, 1.0, 0.0],
+    "c": [0.0, 0.0, 1.0],
+}
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+def test_lru_evicts_least_recently_used_by_size():
+    lru = LRUCache(max_bytes=3, size_of=lambda value: 1)
+    for key in "abc":
+        lru.put(key, key.upper())
+    assert lru.get("a") == "A"
+    lru.put("d", "D")
+    assert lru.get("b") is None
+    assert [lru.get(key) for key in "acd"] == ["A", "C", "D"]
+    assert lru.stats()["evictions"] == 1
+
+def test_lru_skips_values_larger_than_the_cache():
+    lru = LRUCache(max_bytes=100)
+    lru.put("small", np.zeros(10, dtype=np.uint8))
+    lru.put("large", np.zeros(101, dtype=np.uint8))
+    assert "small" in lru and "large" not in lru
+    assert lru.stats()["bytes"] == 10
+
+def test_lru_loads_evicted_entries_from_disk(tmp_path):
+    lru = LRUCache(max_bytes=1, size_of=lambda value: 1, disk_dir=str(tmp_path))
+    lru.put("a", "A")
+    lru.put("b", "B")
+    assert lru.get("a") == "A"
+    assert lru.stats()["disk_hits"] == 1
+    # a new cache on the same directory starts warm
+    assert LRUCache(max_bytes=1, disk_dir=str(tmp_path)).get("b") == "B"
+
+def test_lru_bounds_disk_tier(tmp_path):
+    lru = LRUCache(max_bytes=1, size_of=lambda value: 1, disk_dir=str(tmp_path), max_disk_bytes=1)
+    lru.put("a", "A")
+    lru.put("b", "B")
+    assert lru.stats()["disk_entries"] == 1
+    assert lru.get("a") is None
+
+def test_semantic_cache_matches_similar_text(clock):
+    semantic = SemanticCache(vectors.__getitem__, threshold=0.95)
+    semantic.put("a", "answer a")
+    value, embedding = semantic.lookup("a'")
+    assert value == "answer a"
+    assert np.isclose(np.linalg.norm(embedding), 1)
+    assert semantic.lookup("b")[0] is None
+
+def test_semantic_cache_entries_expire(clock):
+    semantic = SemanticCache(vectors.__getitem__, ttl_s=10)
+    semantic.put("a", "answer a")
+    clock[0] += 10
+    assert semantic.lookup("a")[0] == "answer a"
+    clock[0] += 1
+    assert semantic.lookup("a")[0] is None
+    assert semantic.stats()["entries"] == 0
+
+def test_semantic_cache_entries_only_match_their_version(clock):
+    semantic = SemanticCache(vectors.__getitem__, version="v1")
+    semantic.put("a", "answer a")
+    semantic.version = "v2"
+    assert semantic.lookup("a")[0] is None
+    semantic.version = "v1"
+    assert semantic.lookup("a")[0] == "answer a"
+
+def test_semantic_cache_evicts_invalid_then_least_recently_used(clock):
+    semantic = SemanticCache(vectors.__getitem__, max_entries=2, ttl_s=10)
+    semantic.put("a", "answer a")
+    clock[0] += 5
+    semantic.put("b", "answer b")
+    clock[0] += 6
+    # a has expired, so it is replaced even though b was used less recently
+    semantic.put("c", "answer c")
+    assert [semantic.lookup(text)[0] for text in "bc"] == ["answer b", "answer c"]
+    clock[0] += 1
+    semantic.lookup("b")
+    semantic.put("a", "answer a")
+    assert [semantic.lookup(text)[0] for text in "abc"] == ["answer a", "answer b", None]
+    assert semantic.stats()["evictions"] == 2
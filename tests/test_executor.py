@@ -0,0 +1,28 @@
+import asyncio
+import threading
+import pytest
+from backend.executor import ModelExecutor, QueueFullError
+
+def blocking_call(event):
+    event.wait(5)
+
+def count_to(n):
+    yield from range(n)
+
+def test_admitted_stream_is_not_cut_off_by_full_queue():
+    async def main():
+        executor = ModelExecutor("test", max_workers=1, max_queue_size=1)
+        release = threading.Event()
+        stream = await executor.iterate(count_to, 3)
+        # the only worker is busy and the queue is full, so new calls and streams are rejected
+        busy = asyncio.ensure_future(executor.run(blocking_call, release))
+        await asyncio.sleep(0.05)
+        queued = asyncio.ensure_future(executor.run(blocking_call, release))
+        await asyncio.sleep(0.05)
+        with pytest.raises(QueueFullError):
+            await executor.iterate(count_to, 3)
+        release.set()
+        assert [item async for item in stream] == [0, 1, 2]
+        await asyncio.gather(busy, queued)
+        executor.shutdown()
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+import pytest
+pytest.importorskip("prometheus_client")
+pytest.importorskip("langchain_chroma")
+pytest.importorskip("langchain_huggingface")
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+from backend import rag
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+class FakeVectorStore:
+    embeddings = FakeEmbeddings()
+
+    def similarity_search_by_vector(self, embedding, k=6):
+        return [Document(page_content=f"doc{i}") for i in range(k)]
+
+def unreachable_chat_model(prompt):
+    raise ConnectionError("chat model is unreachable")
+
+def test_speculative_falls_back_to_raw_results_when_hypothetical_answer_fails():
+    before = rag.speculative_retrieval_stats()
+    docs, contexts = rag._retrieve_speculative([HumanMessage(content="什么是交大？")], RunnableLambda(unreachable_chat_model), FakeVectorStore())
+    after = rag.speculative_retrieval_stats()
+    assert contexts == [f"doc{i}" for i in range(6)]
+    assert after["errors"] == before["errors"] + 1
+    assert after["fallbacks"] == before["fallbacks"] + 1
+
+class QueryOnlyEmbeddings(FakeEmbeddings):
+    def embed_documents(self, texts):
+        raise AssertionError("queries must be embedded with embed_query")
+
+class QueryOnlyVectorStore(FakeVectorStore):
+    embeddings = QueryOnlyEmbeddings()
+
+def test_batch_inference_embeds_with_embed_query(monkeypatch):
+    answers = iter(["假设的回答", "最终回答"])
+    chat_model = RunnableLambda(lambda prompt: AIMessage(content=next(answers)))
+    monkeypatch.setattr(rag, "_hypo_cache", None)
+    monkeypatch.setattr(rag, "_hypo_cache_version", "")
+    rag.configure_hypo_cache("test")
+    [(answer, contexts)] = rag.batch_inference([[HumanMessage(content="什么是交大？")]], chat_model, QueryOnlyVectorStore(), "speculative")
+    cached = rag._get_cached_hypo("什么是交大？", "speculative")
+    assert answer.content == "最终回答"
+    assert cached[0] == "假设的回答"
+    assert cached[1].tolist() == FakeEmbeddings().embed_query("假设的回答")
+
+def docs(*names):
+    return [Document(page_content=name) for name in names]
+
+def test_rrf_ranks_docs_found_by_both_lists_first():
+    fused = rag._reciprocal_rank_fusion([docs("a", "b", "c"), docs("c", "d", "a")], k=4)
+    assert [doc.page_content for doc in fused] == ["a", "c", "b", "d"]
+
+def test_rrf_keeps_first_list_order_on_ties_and_truncates():
+    fused = rag._reciprocal_rank_fusion([docs("a", "b"), docs("c", "d")], k=3)
+    assert [doc.page_content for doc in fused] == ["a", "c", "b"]
+
+def test_rrf_merges_by_id_before_content():
+    first = Document(page_content="same text", id="1")
+    second = Document(page_content="same text", id="2")
+    fused = rag._reciprocal_rank_fusion([[first], [second, first]])
+    assert [doc.id for doc in fused] == ["1", "2"]
+
+def test_reconfiguring_speculative_retrieval_shuts_down_the_old_pool(monkeypatch):
+    monkeypatch.setattr(rag, "_speculative_budget_s", rag._speculative_budget_s)
+    monkeypatch.setattr(rag, "_speculative_pool", rag._speculative_pool)
+    rag.configure_speculative_retrieval(1.0, 2)
+    old_pool = rag._speculative_pool
+    assert old_pool.submit(lambda: "done").result() == "done"
+    rag.configure_speculative_retrieval(1.0, 2)
+    with pytest.raises(RuntimeError):
+        old_pool.submit(lambda: "done")
+    assert rag._speculative_pool is not old_pool
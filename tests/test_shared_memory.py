@@ -0,0 +1,78 @@
+import asyncio
+import os
+import time
+import numpy as np
+import pytest
+pytest.importorskip("prometheus_client")
+from backend.executor import QueueFullError
+from backend.workers import WorkerProcess, WorkerUnavailableError
+
+pytestmark = pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="needs /dev/shm")
+
+def load_nothing():
+    return {}
+
+def array_size(seconds, array):
+    time.sleep(seconds)
+    return int(array.size)
+
+def shared_memory_blocks():
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+def large_array():
+    return np.ones(100_000, dtype=np.float32)
+
+@pytest.fixture
+def worker():
+    worker = WorkerProcess("test", load_nothing, max_workers=1, max_queue_size=1)
+    worker.wait_ready(timeout=60)
+    yield worker
+    worker.shutdown()
+
+def wait_for_blocks(expected, timeout=10):
+    deadline = time.monotonic() + timeout
+    while shared_memory_blocks() != expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return shared_memory_blocks()
+
+def test_round_trip_leaves_no_blocks(worker):
+    before = shared_memory_blocks()
+    assert asyncio.run(worker.run(array_size, 0, large_array())) == 100_000
+    assert wait_for_blocks(before) == before
+
+def test_rejected_call_creates_no_blocks(worker):
+    async def main():
+        running = asyncio.ensure_future(worker.run(array_size, 0.5, large_array()))
+        queued = asyncio.ensure_future(worker.run(array_size, 0, large_array()))
+        await asyncio.sleep(0.1)
+        with pytest.raises(QueueFullError):
+            await worker.run(array_size, 0, large_array())
+        await asyncio.gather(running, queued)
+    before = shared_memory_blocks()
+    asyncio.run(main())
+    assert wait_for_blocks(before) == before
+
+def test_dead_worker_discards_unpacked_arguments(worker):
+    async def main():
+        running = asyncio.ensure_future(worker.run(array_size, 10, large_array()))
+        queued = asyncio.ensure_future(worker.run(array_size, 0, large_array()))
+        await asyncio.sleep(0.5)
+        worker._process.kill()
+        for call in (running, queued):
+            with pytest.raises(WorkerUnavailableError):
+                await call
+    before = shared_memory_blocks()
+    asyncio.run(main())
+    assert wait_for_blocks(before) == before
+
+def test_cancelled_call_discarded_at_shutdown(worker):
+    async def main():
+        running = asyncio.ensure_future(worker.run(array_size, 1, large_array()))
+        queued = asyncio.ensure_future(worker.run(array_size, 0, large_array()))
+        await asyncio.sleep(0.3)
+        queued.cancel()
+        worker.shutdown()
+        await asyncio.gather(running, queued, return_exceptions=True)
+    before = shared_memory_blocks()
+    asyncio.run(main())
+    assert wait_for_blocks(before) == before
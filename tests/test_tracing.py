@@ -0,0 +1,23 @@
+import json
+import logging
+from backend.tracing import configure_trace_log, finish_trace, start_trace
+
+def test_finished_trace_is_logged_at_info_not_printed(capsys, caplog):
+    configure_trace_log(None)
+    with caplog.at_level(logging.INFO, logger="backend.tracing"):
+        trace = start_trace(endpoint="/tts")
+        finish_trace(trace, 200)
+    assert capsys.readouterr().out == ""
+    assert [record.levelno for record in caplog.records] == [logging.INFO]
+    assert trace.trace_id in caplog.records[0].getMessage()
+
+def test_trace_log_gets_one_line_per_request(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    configure_trace_log(str(path))
+    try:
+        for status in (200, 503):
+            finish_trace(start_trace(endpoint="/asr"), status)
+    finally:
+        configure_trace_log(None)
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["status"] for record in records] == [200, 503]
@@ -0,0 +1,73 @@
+import random
+import pytest
+torch = pytest.importorskip("torch")
+pytest.importorskip("TTS")
+from backend import tts
+from backend.tts import _balance_parts
+
+def greedy_groups(lengths, threshold):
+    groups, current = [], 0
+    for i, length in enumerate(lengths):
+        if not groups or current + length > threshold:
+            groups.append([])
+            current = 0
+        groups[-1].append(i)
+        current += length
+    return groups
+
+def check(lengths, threshold):
+    groups = _balance_parts(list(range(len(lengths))), lengths, threshold)
+    greedy = greedy_groups(lengths, threshold)
+    assert [i for group in groups for i in group] == list(range(len(lengths)))
+    assert len(groups) == len(greedy)
+    for group in groups:
+        assert len(group) == 1 or sum(lengths[i] for i in group) <= threshold
+    longest = max((sum(lengths[i] for i in group) for group in groups), default=0)
+    assert longest <= max((sum(lengths[i] for i in group) for group in greedy), default=0)
+    return groups
+
+def test_keeps_greedy_count_around_long_part():
+    assert check([30, 5, 45, 10], 40) == [[0, 1], [2], [3]]
+
+def test_balances_segments():
+    assert check([10] * 9, 40) == [[0, 1, 2], [3, 4, 5], [6, 7, 8]]
+
+def test_empty():
+    assert _balance_parts([], [], 40) == []
+
+def test_random_against_greedy():
+    rng = random.Random(0)
+    for _ in range(2000):
+        lengths = [rng.randint(1, 60) for _ in range(rng.randint(1, 15))]
+        check(lengths, 40)
+
+class FakeXtts:
+    device = "cpu"
+
+    def __init__(self):
+        self.computed = 0
+
+    def get_conditioning_latents(self, **kwargs):
+        self.computed += 1
+        return torch.full((1, 2), float(self.computed)), torch.ones(3)
+
+def test_conditioning_latents_are_recomputed_for_another_checkpoint(tmp_path, monkeypatch):
+    speaker_wav = tmp_path / "zh-sample.wav"
+    speaker_wav.write_bytes(b"")
+    model = FakeXtts()
+    monkeypatch.setattr(tts, "_model_version", "v1")
+    first, _ = tts._load_or_compute_conditioning_latents(model, str(speaker_wav), str(tmp_path))
+    again, _ = tts._load_or_compute_conditioning_latents(model, str(speaker_wav), str(tmp_path))
+    assert model.computed == 1 and torch.equal(first, again)
+    monkeypatch.setattr(tts, "_model_version", "v2")
+    other, _ = tts._load_or_compute_conditioning_latents(model, str(speaker_wav), str(tmp_path))
+    assert model.computed == 2 and not torch.equal(first, other)
+
+def test_unreadable_latents_file_is_recomputed(tmp_path, monkeypatch):
+    speaker_wav = tmp_path / "zh-sample.wav"
+    speaker_wav.write_bytes(b"")
+    (tmp_path / f"zh-sample_cond{tts._gpt_cond_len}.pt").write_bytes(b"not a checkpoint")
+    model = FakeXtts()
+    monkeypatch.setattr(tts, "_model_version", "v1")
+    tts._load_or_compute_conditioning_latents(model, str(speaker_wav), str(tmp_path))
+    assert model.computed == 1
@@ -0,0 +1,63 @@
+import numpy as np
+from backend.vad import EnergyVAD, split_at_silences
+
+sample_rate = 16000
+
+def check_ranges(ranges, length, max_chunk_s):
+    assert ranges[0][0] == 0 and ranges[-1][1] == length
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    assert all(0 < end - start <= max_chunk_s * sample_rate for start, end in ranges)
+
+def test_short_audio_is_one_chunk():
+    audio = np.ones(sample_rate * 5, dtype=np.float32)
+    assert split_at_silences(audio, sample_rate, 10) == [(0, len(audio))]
+
+def test_cuts_fall_into_pauses():
+    rng = np.random.default_rng(0)
+    parts, pauses = [], []
+    for speech_s in (7, 6, 8, 5):
+        parts.append(rng.uniform(-0.5, 0.5, speech_s * sample_rate).astype(np.float32))
+        start = sum(map(len, parts))
+        parts.append(np.zeros(sample_rate // 2, dtype=np.float32))
+        pauses.append((start, start + sample_rate // 2))
+    audio = np.concatenate(parts)
+    ranges = split_at_silences(audio, sample_rate, 10)
+    check_ranges(ranges, len(audio), 10)
+    for _, cut in ranges[:-1]:
+        assert any(start <= cut < end for start, end in pauses), cut
+
+def test_audio_without_pauses_is_still_bounded():
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, sample_rate * 33).astype(np.float32)
+    check_ranges(split_at_silences(audio, sample_rate, 10), len(audio), 10)
+
+def test_chunk_shorter_than_a_frame():
+    audio = np.ones(100, dtype=np.float32)
+    check_ranges(split_at_silences(audio, sample_rate, 0.001), len(audio), 0.001)
+
+def stream_segments(audio: np.ndarray, chunk_len: int = 1600) -> list[tuple[float, np.ndarray]]:
+    vad = EnergyVAD(sample_rate)
+    segments = []
+    for i in range(0, len(audio), chunk_len):
+        segments += vad.process(audio[i:i+chunk_len])
+    return segments + vad.flush()
+
+def test_speech_at_stream_start_is_detected():
+    speech = np.random.default_rng(0).uniform(-0.5, 0.5, sample_rate * 2).astype(np.float32)
+    segments = stream_segments(speech)
+    assert len(segments) == 1 and segments[0][0] == 0
+
+def test_speech_pause_speech_from_stream_start_gives_two_segments():
+    rng = np.random.default_rng(0)
+    audio = np.concatenate([rng.uniform(-0.5, 0.5, sample_rate * 2), np.zeros(sample_rate), rng.uniform(-0.5, 0.5, sample_rate * 2)]).astype(np.float32)
+    starts = [start for start, _ in stream_segments(audio)]
+    assert len(starts) == 2 and starts[0] == 0 and 2.5 < starts[1] < 3
+
+def test_steady_background_noise_is_learned():
+    rng = np.random.default_rng(0)
+    noise = rng.uniform(-0.05, 0.05, sample_rate * 20).astype(np.float32)
+    audio = noise.copy()
+    audio[sample_rate * 15:sample_rate * 17] += rng.uniform(-0.5, 0.5, sample_rate * 2).astype(np.float32)
+    segments = stream_segments(audio)
+    # after the floor has adapted, only the speech stands out
+    assert 14.5 < segments[-1][0] < 15
+    assert all(start < 5 for start, _ in segments[:-1])
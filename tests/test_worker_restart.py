@@ -0,0 +1,39 @@
+import asyncio
+import time
+import pytest
+pytest.importorskip("prometheus_client")
+from backend.workers import WorkerProcess, ModelRef, call_method
+
+class Model:
+    def __init__(self):
+        self.warmup_calls = 0
+
+    def warm(self):
+        self.warmup_calls += 1
+
+    def get_warmup_calls(self):
+        return self.warmup_calls
+
+def load_model():
+    return {"model": Model()}
+
+def warm_model(model):
+    model.warm()
+
+def test_restarted_worker_warms_up_before_taking_calls():
+    worker = WorkerProcess("test", load_model)
+    worker.warmup = (warm_model, (ModelRef("model"),), 2)
+    try:
+        worker.wait_ready(timeout=60)
+        # the first process is warmed up by the caller
+        assert asyncio.run(worker.run(call_method, ModelRef("model"), "get_warmup_calls")) == 0
+        worker._process.kill()
+        deadline = time.monotonic() + 30
+        while worker.stats()["alive"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not worker.stats()["alive"]
+        worker.wait_ready(timeout=60)
+        assert worker.stats()["alive"] and worker.stats()["restarts"] == 1
+        assert asyncio.run(worker.run(call_method, ModelRef("model"), "get_warmup_calls")) == 2
+    finally:
+        worker.shutdown()
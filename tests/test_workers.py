@@ -0,0 +1,57 @@
+import asyncio
+from functools import partial
+import pytest
+pytest.importorskip("prometheus_client")
+pytest.importorskip("langchain_chroma")
+pytest.importorskip("langchain_huggingface")
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessageChunk, HumanMessage
+from backend.rag import prepare_inference
+from backend.workers import WorkerProcess, ModelRef, call_method, call_function
+
+class EchoChatModel:
+    """
+    Streams the content of the latest message back, so the answer shows the prompt the model was given
+    """
+    def stream(self, messages):
+        content = messages[-1].content
+        for i in range(0, len(content), 16):
+            yield AIMessageChunk(content=content[i:i+16])
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+class FakeVectorStore:
+    embeddings = FakeEmbeddings()
+
+    def similarity_search_by_vector(self, embedding, k=6):
+        return [Document(page_content=f"检索到的上下文{i}", metadata={"url": f"https://www.sjtu.edu.cn/{i}.html"}) for i in range(k)]
+
+def load_fake_rag():
+    return {"chat_model": EchoChatModel(), "vectorstore": FakeVectorStore()}
+
+@pytest.fixture(scope="module")
+def rag_worker():
+    worker = WorkerProcess("rag", load_fake_rag, max_workers=2)
+    worker.wait_ready(timeout=120)
+    yield worker
+    worker.shutdown()
+
+def test_streamed_answer_uses_context_retrieved_in_worker(rag_worker):
+    async def stream():
+        messages = [HumanMessage(content="科技创新行动计划的申报要求是什么？")]
+        links, contexts, messages = await rag_worker.run(prepare_inference, messages, ModelRef("chat_model"), ModelRef("vectorstore"), "raw")
+        chunks = [chunk.content async for chunk in await rag_worker.iterate(call_method, ModelRef("chat_model"), "stream", messages)]
+        return links, contexts, "".join(chunks)
+    links, contexts, answer = asyncio.run(stream())
+    assert links == [f"https://www.sjtu.edu.cn/{i}.html" for i in range(6)]
+    assert contexts and all(context in answer for context in contexts)
+    assert "科技创新行动计划的申报要求是什么？" in answer
+
+def test_function_called_by_name_runs_in_worker(rag_worker):
+    messages = [HumanMessage(content="科技创新行动计划的申报要求是什么？")]
+    links, contexts, _ = asyncio.run(rag_worker.run(partial(call_function, "backend.rag", "prepare_inference"),
+                                                    messages, ModelRef("chat_model"), ModelRef("vectorstore"), "raw"))
+    assert links == [f"https://www.sjtu.edu.cn/{i}.html" for i in range(6)]
+    assert len(contexts) == 6
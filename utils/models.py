@@ -1,47 +1,253 @@
-from typing import Any
+import asyncio
+import queue
+import threading
+import uuid
+from timeit import default_timer as timer
+from typing import Any, AsyncIterator, Callable, Iterator
 from transformers import AutoTokenizer
-from vllm import LLM, SamplingParams
+from vllm import LLM, SamplingParams, AsyncEngineArgs, AsyncLLMEngine
 from langchain_core.language_models import BaseChatModel
-from langchain_core.messages import AIMessage, BaseMessage, convert_to_openai_messages
-from langchain_core.outputs import ChatGeneration, ChatResult
-from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, convert_to_openai_messages
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.runnables import RunnableConfig
+
+def _usage_metadata(output) -> dict:
+    """
+    LangChain usage_metadata of a vllm RequestOutput
+    """
+    input_tokens = len(output.prompt_token_ids or [])
+    output_tokens = len(output.outputs[0].token_ids)
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
 
 class QwenModel(BaseChatModel):
+    """
+    async_engine=False: offline vllm.LLM, one blocking generate call per prompt (no token streaming).
+    async_engine=True: vllm.AsyncLLMEngine running on a dedicated event loop thread; supports _stream/_astream
+    and can be called from any thread or event loop. Prompts from concurrent callers are admitted into the same
+    running batch (continuous batching), up to max_num_seqs sequences; see batch_stats().
+    Generated messages carry usage_metadata (token counts); when streaming, it comes with a last, empty chunk.
+    """
     model: str
-    def __init__(self, model: str, gpu_memory_utilization: float = 0.6):
+    def __init__(self, model: str, gpu_memory_utilization: float = 0.6, async_engine: bool = False, max_num_seqs: int = 256):
         super().__init__(model=model)
         quantization = None
         if "GPTQ" in model:
             quantization = "gptq"
         elif "AWQ" in model:
             quantization = "awq"
-        self._model = LLM(model=model, quantization=quantization, gpu_memory_utilization=gpu_memory_utilization)
+        self._sampling_params = SamplingParams(temperature=0.7, top_p=0.8, repetition_penalty=1.05, max_tokens=512)
+        self._max_num_seqs = max_num_seqs
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._admitted = 0
+        self._occupancy_integral = 0.0
+        self._occupancy_start = timer()
+        self._occupancy_last_change = self._occupancy_start
+        if async_engine:
+            self._model = None
+            self._loop = asyncio.new_event_loop()
+            self._loop_thread = threading.Thread(target=self._loop.run_forever, name="qwen-engine-loop", daemon=True)
+            self._loop_thread.start()
+            engine_args = AsyncEngineArgs(model=model, quantization=quantization, gpu_memory_utilization=gpu_memory_utilization,
+                                          max_num_seqs=max_num_seqs)
+            self._engine = AsyncLLMEngine.from_engine_args(engine_args)
+        else:
+            self._engine = None
+            self._model = LLM(model=model, quantization=quantization, gpu_memory_utilization=gpu_memory_utilization, max_num_seqs=max_num_seqs)
         self._tokenizer = AutoTokenizer.from_pretrained(self.model)
 
-    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager: CallbackManagerForLLMRun | None = None, **kwargs: Any) -> ChatResult:
+    def _get_prompt(self, messages: list[BaseMessage]) -> str:
         oai_messages = convert_to_openai_messages(messages)
-        text = self._tokenizer.apply_chat_template(
+        return self._tokenizer.apply_chat_template(
             oai_messages,
             tokenize=False,
             add_generation_prompt=True
         )
-        outputs = self._model.generate(
-            [text],
-            sampling_params = SamplingParams(temperature=0.7, top_p=0.8, repetition_penalty=1.05, max_tokens=512)
-        )
-        print(len(outputs))
-        print(len(outputs[0].outputs))
-        response_text = outputs[0].outputs[0].text
+
+    def _update_in_flight(self, change: int):
+        """
+        Only called on self._loop, so no lock is needed
+        """
+        now = timer()
+        self._occupancy_integral += self._in_flight * (now - self._occupancy_last_change)
+        self._occupancy_last_change = now
+        self._in_flight += change
+        if change > 0:
+            self._admitted += change
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+    async def _engine_stream(self, prompt: str, usage: dict | None = None) -> AsyncIterator[str]:
+        """
+        Yields text deltas; must run on self._loop. usage, if given, is filled with the usage metadata at the end.
+        """
+        previous_len = 0
+        output = None
+        self._update_in_flight(1)
+        try:
+            async for output in self._engine.generate(prompt, self._sampling_params, request_id=uuid.uuid4().hex):
+                text = output.outputs[0].text
+                delta = text[previous_len:]
+                previous_len = len(text)
+                if delta:
+                    yield delta
+            if usage is not None and output is not None:
+                usage.update(_usage_metadata(output))
+        finally:
+            self._update_in_flight(-1)
+
+    def batch_stats(self) -> dict:
+        """
+        Occupancy of the engine's running batch, as seen from the requests submitted to this model.
+        Requests beyond max_num_seqs wait in the engine's queue.
+        """
+        now = timer()
+        in_flight = self._in_flight
+        integral = self._occupancy_integral + in_flight * (now - self._occupancy_last_change)
+        mean_in_flight = integral / max(now - self._occupancy_start, 1e-9)
+        return {
+            "async_engine": self._engine is not None,
+            "max_num_seqs": self._max_num_seqs,
+            "in_flight": in_flight,
+            "peak_in_flight": self._peak_in_flight,
+            "admitted": self._admitted,
+            "mean_in_flight": mean_in_flight,
+            "batch_occupancy": min(in_flight, self._max_num_seqs) / self._max_num_seqs,
+            "mean_batch_occupancy": min(mean_in_flight, self._max_num_seqs) / self._max_num_seqs,
+        }
+
+    async def _engine_generate(self, prompt: str) -> tuple[str, dict]:
+        """
+        returns (text, usage metadata)
+        """
+        usage = {}
+        text = "".join([delta async for delta in self._engine_stream(prompt, usage)])
+        return text, usage
+
+    def _submit_stream(self, prompt: str, push: Callable[[Any], None]):
+        """
+        Runs the generation on the engine loop and pushes each delta, then the usage metadata dict and None at the end
+        (or the raised exception). Cancelling the returned future aborts the request in the engine.
+        """
+        async def run():
+            try:
+                usage = {}
+                async for delta in self._engine_stream(prompt, usage):
+                    push(delta)
+                push(usage)
+                push(None)
+            except Exception as e:
+                push(e)
+        return asyncio.run_coroutine_threadsafe(run(), self._loop)
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager: CallbackManagerForLLMRun | None = None, **kwargs: Any) -> ChatResult:
+        text = self._get_prompt(messages)
+        if self._engine is not None:
+            response_text, usage = asyncio.run_coroutine_threadsafe(self._engine_generate(text), self._loop).result()
+        else:
+            outputs = self._model.generate(
+                [text],
+                sampling_params = self._sampling_params
+            )
+            response_text = outputs[0].outputs[0].text
+            usage = _usage_metadata(outputs[0])
         response_message = AIMessage(
-            content=response_text
+            content=response_text,
+            usage_metadata=usage or None
         )
         response_generation = ChatGeneration(message=response_message)
         return ChatResult(generations=[response_generation])
-    
+
+    async def _agenerate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager: AsyncCallbackManagerForLLMRun | None = None, **kwargs: Any) -> ChatResult:
+        if self._engine is None:
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        text = self._get_prompt(messages)
+        response_text, usage = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._engine_generate(text), self._loop))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=response_text, usage_metadata=usage or None))])
+
+    def _stream(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager: CallbackManagerForLLMRun | None = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        if self._engine is None:
+            # the offline engine cannot stream, so the whole answer comes as one chunk
+            message = self._generate(messages, stop, run_manager, **kwargs).generations[0].message
+            yield ChatGenerationChunk(message=AIMessageChunk(content=message.content, usage_metadata=message.usage_metadata))
+            return
+        deltas = queue.Queue()
+        future = self._submit_stream(self._get_prompt(messages), deltas.put)
+        try:
+            while (delta := deltas.get()) is not None:
+                if isinstance(delta, Exception):
+                    raise delta
+                if isinstance(delta, dict):
+                    yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=delta or None))
+                    continue
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=delta))
+                if run_manager:
+                    run_manager.on_llm_new_token(delta, chunk=chunk)
+                yield chunk
+        finally:
+            future.cancel()
+
+    async def _astream(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager: AsyncCallbackManagerForLLMRun | None = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        if self._engine is None:
+            message = (await self._agenerate(messages, stop, run_manager, **kwargs)).generations[0].message
+            yield ChatGenerationChunk(message=AIMessageChunk(content=message.content, usage_metadata=message.usage_metadata))
+            return
+        loop = asyncio.get_running_loop()
+        deltas = asyncio.Queue()
+        future = self._submit_stream(self._get_prompt(messages), lambda delta: loop.call_soon_threadsafe(deltas.put_nowait, delta))
+        try:
+            while (delta := await deltas.get()) is not None:
+                if isinstance(delta, Exception):
+                    raise delta
+                if isinstance(delta, dict):
+                    yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=delta or None))
+                    continue
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=delta))
+                if run_manager:
+                    await run_manager.on_llm_new_token(delta, chunk=chunk)
+                yield chunk
+        finally:
+            future.cancel()
+
+    def batch_generate(self, messages_list: list[list[BaseMessage]], max_batch_size: int | None = None,
+                       progress_callback: Callable[[int, int], None] | None = None) -> list[AIMessage]:
+        """
+        Generates one answer per message list with a single engine call per batch (all at once if max_batch_size is None).
+        progress_callback(num_done, num_total) is called after each batch.
+        returns the answers in input order
+        """
+        prompts = [self._get_prompt(messages) for messages in messages_list]
+        batch_size = max_batch_size or max(len(prompts), 1)
+        results = []
+        for i in range(0, len(prompts), batch_size):
+            batch_prompts = prompts[i:i+batch_size]
+            if self._engine is not None:
+                async def generate_all():
+                    return await asyncio.gather(*[self._engine_generate(prompt) for prompt in batch_prompts])
+                texts_and_usages = asyncio.run_coroutine_threadsafe(generate_all(), self._loop).result()
+            else:
+                outputs = self._model.generate(batch_prompts, sampling_params=self._sampling_params, use_tqdm=False)
+                texts_and_usages = [(output.outputs[0].text, _usage_metadata(output)) for output in outputs]
+            results.extend(AIMessage(content=text, usage_metadata=usage or None) for text, usage in texts_and_usages)
+            if progress_callback:
+                progress_callback(len(results), len(prompts))
+        return results
+
+    def batch(self, inputs: list[Any], config: RunnableConfig | list[RunnableConfig] | None = None, *,
+              return_exceptions: bool = False, **kwargs: Any) -> list[AIMessage]:
+        """
+        Uses batch_generate instead of BaseChatModel's one _generate call per input in threads.
+        Falls back to the default implementation when per-input exceptions are requested.
+        """
+        if return_exceptions:
+            return super().batch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+        messages_list = [self._convert_input(input).to_messages() for input in inputs]
+        return self.batch_generate(messages_list, max_batch_size=kwargs.get("max_batch_size"))
+
     @property
     def _llm_type(self) -> str:
         return "qwen"
-    
+
     @property
     def _identifying_params(self) -> dict[str, Any]:
-        return {"model": self.model}
\ No newline at end of file
+        return {"model": self.model}
@@ -0,0 +1,30 @@
+import json
+import os
+from functools import lru_cache
+from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+
+_templates_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_templates")
+
+@lru_cache(maxsize=None)
+def _load_prompt_file(name: str) -> dict:
+    path = os.path.join(_templates_dir, f"{name}.json")
+    if not os.path.exists(path):
+        raise ValueError(f"Unknown prompt: {name}")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+@lru_cache(maxsize=None)
+def load_prompt(name: str, version: str | None = None) -> ChatPromptTemplate | PromptTemplate:
+    """
+    Loads a vendored prompt from utils/prompt_templates/<name>.json (no network access), loaded once per process.
+    Pin version for reproducible results; None loads the file's "latest" version.
+    Versions with "messages" ([role, template] pairs) are chat prompts, versions with "template" string prompts.
+    """
+    data = _load_prompt_file(name)
+    version = version or data["latest"]
+    if version not in data["versions"]:
+        raise ValueError(f"Unknown version {version} of prompt {name}, available: {', '.join(data['versions'])}")
+    spec = data["versions"][version]
+    if "messages" in spec:
+        return ChatPromptTemplate.from_messages([tuple(message) for message in spec["messages"]])
+    return PromptTemplate.from_template(spec["template"])